@@ -1,3 +1,4 @@
 from .agent import CommunicationAgent
+from .campaign import CampaignRunner
 
-__all__ = ["CommunicationAgent"]
+__all__ = ["CommunicationAgent", "CampaignRunner"]
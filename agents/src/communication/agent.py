@@ -1,5 +1,6 @@
 import asyncio
-from typing import Optional
+import time
+from typing import AsyncIterator, Callable, Optional
 
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage
@@ -8,11 +9,21 @@ from typing_extensions import TypedDict
 
 from ..shared.api_client import APIClient
 from ..shared.config import settings
+from ..shared.llm_replay import replayable
+from ..shared.llm_usage import BudgetExceeded, usage
+from ..shared.outbox import handed_off
+from ..shared.timing import latency
+from ..shared.tracing import span
 from ..models.communications import (
     CommunicationType,
     CommunicationMessage,
     DEFAULT_TEMPLATES,
+    DEFAULT_TEMPLATE_VALUES,
 )
+from .dedup import DedupWindow
+from .delivery import DeliveryScheduler
+from .message_cache import CUSTOMER_NAME_TOKEN, MessageCache, personalize
+from .streaming import MessageStreamParser, TokenFiller
 
 
 class CommunicationState(TypedDict):
@@ -43,21 +54,53 @@ class CommunicationAgent:
 
     def __init__(self, api_client: Optional[APIClient] = None):
         self.api_client = api_client or APIClient()
-        self.llm = ChatOpenAI(
-            model=settings.communication_model,
-            api_key=settings.openai_api_key,
-            temperature=0.7,
+        self._llms: dict[str, ChatOpenAI] = {}
+        self.message_cache = MessageCache(
+            ttl_seconds=settings.ai_message_cache_ttl_seconds,
+            max_size=settings.ai_message_cache_size,
         )
+        self.dedup = DedupWindow(settings.notification_dedup_window_seconds)
+        self.delivery: Optional[DeliveryScheduler] = None
+        if settings.delivery_scheduler_enabled:
+            self.delivery = DeliveryScheduler(
+                self._deliver,
+                rates_per_minute={
+                    CommunicationType.EMAIL: settings.email_rate_per_minute,
+                    CommunicationType.SMS: settings.sms_rate_per_minute,
+                    CommunicationType.CALL: settings.call_rate_per_minute,
+                },
+                coalesce_seconds=settings.delivery_coalesce_seconds,
+                quiet_hours=(settings.sms_quiet_hours_start, settings.sms_quiet_hours_end),
+                timezone=settings.office_timezone,
+            )
         self.workflow = self._build_workflow()
 
+    def _llm(self, model_name: str) -> ChatOpenAI:
+        """Client for `model_name`, created on first use."""
+        if model_name not in self._llms:
+            client = ChatOpenAI(
+                model=model_name,
+                api_key=settings.openai_api_key,
+                temperature=0.7,
+                stream_usage=True,
+            )
+            self._llms[model_name] = replayable(client, model_name)
+        return self._llms[model_name]
+
+    async def _choose_model(self, customer_id: Optional[str]) -> str:
+        """The configured model, or its fallback near the LLM budget; raises BudgetExceeded once spent."""
+        return await asyncio.to_thread(
+            usage.choose_model, settings.communication_model, settings.communication_fallback_model, customer_id
+        )
+
     def _build_workflow(self) -> StateGraph:
         """Build the LangGraph workflow for communication."""
         workflow = StateGraph(CommunicationState)
 
-        workflow.add_node("fetch_data", self._fetch_data)
-        workflow.add_node("generate_message", self._generate_message)
-        workflow.add_node("send_message", self._send_message)
-        workflow.add_node("handle_error", self._handle_error)
+        workflow.add_node("fetch_data", latency.node("fetch_data", self._fetch_data))
+        workflow.add_node("generate_message", latency.node("generate_message", self._generate_message))
+        workflow.add_node("send_message", latency.node("send_message", self._send_message))
+        workflow.add_node("handle_error", latency.node("handle_error", self._handle_error))
 
         workflow.set_entry_point("fetch_data")
         workflow.add_conditional_edges(
@@ -88,8 +131,18 @@ class CommunicationAgent:
             return_id: Optional tax return ID
 
         Returns:
-            True if message was sent successfully
+            True if message was sent successfully, or was already sent within
+            the dedup window
+
+        Raises:
+            BudgetExceeded: The message needs the LLM and its budget is spent
         """
+        # Repeats within the dedup window stop here, before any backend or LLM call
+        dedup_key = self.dedup.key(customer_id, return_id, new_status)
+        if not self.dedup.claim(dedup_key):
+            print(f"[Communication] Suppressed duplicate '{new_status}' notification for {customer_id}")
+            return True
+
         initial_state: CommunicationState = {
             "customer_id": customer_id,
             "return_id": return_id,
@@ -101,21 +154,38 @@ class CommunicationAgent:
             "error": None,
         }
 
-        final_state = await self.workflow.ainvoke(initial_state)
-        return final_state.get("sent", False)
+        try:
+            async with latency.run("communication"):
+                final_state = await self.workflow.ainvoke(initial_state)
+        except Exception:
+            self.dedup.release(dedup_key)
+            raise
+
+        sent = final_state.get("sent", False)
+        if not sent:
+            # Let a retry through
+            self.dedup.release(dedup_key)
+        return sent
 
     async def _fetch_data(self, state: CommunicationState) -> CommunicationState:
-        """Fetch customer and return data."""
-        try:
-            # Fetch customer
-            customer = await self.api_client.get_customer(state["customer_id"])
-            state["customer_data"] = customer
+        """Fetch customer and return data concurrently."""
+
+        async def fetch_customer():
+            with latency.branch("fetch_data", "customer"):
+                return await self.api_client.get_customer(state["customer_id"])
 
-            # Fetch return if provided
-            if state["return_id"]:
-                tax_return = await self.api_client.get_return(state["return_id"])
-                state["return_data"] = tax_return
+        async def fetch_return():
+            # Return is optional
+            if not state["return_id"]:
+                return None
+            with latency.branch("fetch_data", "return"):
+                return await self.api_client.get_return(state["return_id"])
 
+        try:
+            state["customer_data"], state["return_data"] = await asyncio.gather(
+                fetch_customer(),
+                fetch_return(),
+            )
         except Exception as e:
             state["error"] = f"Failed to fetch data: {e}"
         return state
@@ -138,8 +208,7 @@ class CommunicationAgent:
                 subject, body = template.render(
                     customer_name=customer_name,
                     tax_year=tax_year,
-                    missing_items="- Please check with our office",
-                    refund_info="Please check your return documents for refund details.",
+                    **DEFAULT_TEMPLATE_VALUES,
                 )
             else:
                 # Generate with AI
@@ -148,6 +217,7 @@ class CommunicationAgent:
                     status=status,
                     tax_year=tax_year,
                     additional_context=tax_return.get("routingSheet", {}).get("notes", ""),
+                    customer_id=state["customer_id"],
                 )
 
             state["message"] = CommunicationMessage(
@@ -159,6 +229,9 @@ class CommunicationAgent:
                 customer_email=customer.get("email"),
             )
 
+        except BudgetExceeded:
+            # Not a failed send - callers park the notification until the budget allows it
+            raise
         except Exception as e:
             state["error"] = f"Failed to generate message: {e}"
         return state
@@ -169,28 +242,58 @@ class CommunicationAgent:
         status: str,
         tax_year: str,
         additional_context: str = "",
+        customer_id: Optional[str] = None,
     ) -> tuple[str, str]:
-        """Generate a message using AI."""
-        system_prompt = """You are a professional assistant for Gordon Ulen CPA, a tax preparation firm.
-Generate friendly, professional email communications for tax clients.
-Keep messages concise but warm. Include relevant details about their tax return status.
-Always sign off with "Best regards, Gordon Ulen CPA Team"."""
-
-        user_prompt = f"""Generate an email for {customer_name} about their {tax_year} tax return.
-Status: {status.replace('_', ' ').title()}
-Additional context: {additional_context or 'None'}
+        """Generate a message using AI, reusing a cached draft for the same status and context."""
+        key = self.message_cache.key(status, tax_year, additional_context)
+        draft = await self.message_cache.get_or_create(
+            key,
+            lambda: self._generate_ai_draft(status, tax_year, additional_context, customer_id),
+        )
+        if draft is not None:
+            return personalize(draft, customer_name)
 
-Provide the email subject and body. Format:
-Subject: [subject line]
-Body:
-[email body]"""
+        # The model didn't keep the name placeholder - generate for this customer
+        return await self._request_ai_message(customer_name, status, tax_year, additional_context, customer_id)
 
-        messages = [
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=user_prompt),
-        ]
+    async def _generate_ai_draft(
+        self,
+        status: str,
+        tax_year: str,
+        additional_context: str,
+        customer_id: Optional[str] = None,
+    ) -> Optional[tuple[str, str]]:
+        """Generate a reusable draft addressed to CUSTOMER_NAME_TOKEN; None if the token was dropped."""
+        subject, body = await self._request_ai_message(
+            CUSTOMER_NAME_TOKEN, status, tax_year, additional_context, customer_id
+        )
+        if CUSTOMER_NAME_TOKEN not in body:
+            return None
+        return subject, body
 
-        response = await self.llm.ainvoke(messages)
+    async def _request_ai_message(
+        self,
+        customer_name: str,
+        status: str,
+        tax_year: str,
+        additional_context: str = "",
+        customer_id: Optional[str] = None,
+    ) -> tuple[str, str]:
+        """Call the LLM and parse its subject and body."""
+        model_name = await self._choose_model(customer_id)
+        messages = self._build_ai_messages(customer_name, status, tax_year, additional_context)
+        started = time.monotonic()
+        with span("llm communication_message", {"llm.model": model_name, "status": status}) as current:
+            response = await self._llm(model_name).ainvoke(messages)
+            cost = await asyncio.to_thread(
+                usage.record,
+                "communication_message",
+                model_name,
+                response,
+                time.monotonic() - started,
+                customer_id=customer_id,
+            )
+            current.set_attribute("llm.cost_usd", cost)
         text = response.content
 
         # Parse response
@@ -211,6 +314,185 @@ Body:
 
         return subject or f"Update on Your {tax_year} Tax Return", body
 
+    def _build_ai_messages(
+        self,
+        customer_name: str,
+        status: str,
+        tax_year: str,
+        additional_context: str = "",
+    ) -> list:
+        """Build the prompt for an AI-generated status message."""
+        system_prompt = """You are a professional assistant for Gordon Ulen CPA, a tax preparation firm.
+Generate friendly, professional email communications for tax clients.
+Keep messages concise but warm. Include relevant details about their tax return status.
+Always sign off with "Best regards, Gordon Ulen CPA Team"."""
+
+        user_prompt = f"""Generate an email for {customer_name} about their {tax_year} tax return.
+Status: {status.replace('_', ' ').title()}
+Additional context: {additional_context or 'None'}
+
+Provide the email subject and body. Format:
+Subject: [subject line]
+Body:
+[email body]"""
+
+        if customer_name == CUSTOMER_NAME_TOKEN:
+            user_prompt += f"\n\nWrite {CUSTOMER_NAME_TOKEN} exactly wherever the client's name belongs; it is filled in later."
+
+        return [
+            SystemMessage(content=system_prompt),
+            HumanMessage(content=user_prompt),
+        ]
+
+    async def stream_preview(
+        self,
+        customer_id: str,
+        status: str,
+        return_id: Optional[str] = None,
+    ) -> AsyncIterator[tuple[str, dict]]:
+        """
+        Stream a message preview as (event, data) pairs.
+
+        Templated statuses and cached drafts yield the message at once.
+        Otherwise the draft is generated through the message cache, and its
+        tokens are streamed as they arrive: the subject once its line is done,
+        the body as deltas. Always ends with a "done" or "error" event.
+        """
+        state: CommunicationState = {
+            "customer_id": customer_id,
+            "return_id": return_id,
+            "status": status,
+            "customer_data": None,
+            "return_data": None,
+            "message": None,
+            "sent": False,
+            "error": None,
+        }
+        state = await self._fetch_data(state)
+        if state["error"]:
+            yield "error", {"error": state["error"]}
+            return
+
+        customer = state["customer_data"]
+        tax_return = state["return_data"] or {}
+        customer_name = f"{customer.get('firstName', '')} {customer.get('lastName', '')}".strip()
+        tax_year = tax_return.get("taxYear", "2024")
+
+        template = DEFAULT_TEMPLATES.get(status)
+        if template:
+            try:
+                subject, body = template.render(
+                    customer_name=customer_name,
+                    tax_year=tax_year,
+                    **DEFAULT_TEMPLATE_VALUES,
+                )
+            except Exception as e:
+                yield "error", {"error": f"Failed to render template: {e}"}
+                return
+            yield "subject", {"text": subject}
+            yield "body", {"text": body}
+            yield "done", {"subject": subject, "body": body, "source": "template"}
+            return
+
+        additional_context = tax_return.get("routingSheet", {}).get("notes", "")
+        key = self.message_cache.key(status, tax_year, additional_context)
+        # Filled only if this preview is the one generating the draft
+        events: asyncio.Queue = asyncio.Queue()
+        generation = asyncio.ensure_future(
+            self.message_cache.get_or_create(
+                key,
+                lambda: self._stream_ai_draft(
+                    status, tax_year, additional_context, customer_id, lambda *event: events.put_nowait(event)
+                ),
+            )
+        )
+        filler = TokenFiller(CUSTOMER_NAME_TOKEN, customer_name)
+        streamed = {"subject": "", "body": ""}
+
+        def fill(event: str, text: str) -> str:
+            text = text.replace(CUSTOMER_NAME_TOKEN, customer_name) if event == "subject" else filler.feed(text)
+            streamed[event] += text
+            return text
+
+        try:
+            while not generation.done():
+                next_event = asyncio.ensure_future(events.get())
+                await asyncio.wait({next_event, generation}, return_when=asyncio.FIRST_COMPLETED)
+                if not next_event.done():
+                    next_event.cancel()
+                    continue
+                event, text = next_event.result()
+                if text := fill(event, text):
+                    yield event, {"text": text}
+            while not events.empty():
+                event, text = events.get_nowait()
+                if text := fill(event, text):
+                    yield event, {"text": text}
+            if rest := filler.flush():
+                streamed["body"] += rest
+                yield "body", {"text": rest}
+
+            draft = await generation
+            if draft is not None:
+                subject, body = personalize(draft, customer_name)
+            elif streamed["body"]:
+                # This preview streamed a draft that dropped the name placeholder; show it as is
+                subject = streamed["subject"] or f"Update on Your {tax_year} Tax Return"
+                body = streamed["body"].strip()
+            else:
+                # Another request's draft dropped the placeholder - generate for this customer
+                subject, body = await self._request_ai_message(
+                    customer_name, status, tax_year, additional_context, customer_id
+                )
+            if not streamed["body"]:
+                yield "subject", {"text": subject}
+                yield "body", {"text": body}
+        except Exception as e:
+            yield "error", {"error": f"Failed to generate message: {e}"}
+            return
+        finally:
+            # A disconnected client doesn't cancel a draft other requests may be waiting on
+            generation.cancel()
+
+        yield "done", {"subject": subject, "body": body, "source": "ai"}
+
+    async def _stream_ai_draft(
+        self,
+        status: str,
+        tax_year: str,
+        additional_context: str,
+        customer_id: Optional[str],
+        on_event: Callable[[str, str], None],
+    ) -> Optional[tuple[str, str]]:
+        """Streaming _generate_ai_draft: parsed "subject"/"body" events go to `on_event` as they arrive."""
+        model_name = await self._choose_model(customer_id)
+        messages = self._build_ai_messages(CUSTOMER_NAME_TOKEN, status, tax_year, additional_context)
+        parser = MessageStreamParser()
+        started = time.monotonic()
+        with span("llm communication_preview", {"llm.model": model_name, "status": status}) as current:
+            # Chunks are summed so the usage metadata on the last one is counted
+            response = None
+            async for chunk in self._llm(model_name).astream(messages):
+                response = chunk if response is None else response + chunk
+                for event, text in parser.feed(chunk.content):
+                    on_event(event, text)
+            for event, text in parser.finish():
+                on_event(event, text)
+            cost = await asyncio.to_thread(
+                usage.record,
+                "communication_preview",
+                model_name,
+                response,
+                time.monotonic() - started,
+                customer_id=customer_id,
+            )
+            current.set_attribute("llm.cost_usd", cost)
+
+        body = parser.body.strip()
+        if CUSTOMER_NAME_TOKEN not in body:
+            return None
+        return parser.subject or f"Update on Your {tax_year} Tax Return", body
+
     async def _send_message(self, state: CommunicationState) -> CommunicationState:
         """Send the communication via API."""
         try:
@@ -219,14 +501,7 @@ Body:
                 state["error"] = "No message to send"
                 return state
 
-            await self.api_client.send_communication(
-                customer_id=message.customer_id,
-                comm_type=message.comm_type.value,
-                content=message.content,
-                subject=message.subject,
-                triggered_by="agent",
-            )
-
+            await self._submit(message)
             state["sent"] = True
             print(f"[Communication] Sent {message.comm_type.value} to {message.customer_email}")
 
@@ -234,6 +509,55 @@ Body:
             state["error"] = f"Failed to send message: {e}"
         return state
 
+    async def send_message(
+        self,
+        message: CommunicationMessage,
+        status: str,
+        return_id: Optional[str] = None,
+    ) -> bool:
+        """
+        Send an already-rendered message the way status notifications go out.
+
+        The message passes the dedup window for (customer, return, status),
+        then the delivery scheduler's rate caps, coalescing and quiet hours.
+
+        Returns:
+            True once sent; False if suppressed as a repeat within the dedup window
+
+        Raises:
+            Exception: Delivery failed; the dedup claim is released so a retry can go out
+        """
+        dedup_key = self.dedup.key(message.customer_id, return_id, status)
+        if not self.dedup.claim(dedup_key):
+            return False
+        try:
+            await self._submit(message)
+        except BaseException:
+            self.dedup.release(dedup_key)
+            raise
+        return True
+
+    async def _submit(self, message: CommunicationMessage) -> None:
+        """Deliver `message`, through the delivery scheduler when it is running."""
+        if self.delivery and self.delivery.running:
+            # Rate-capped, coalesced delivery; only counts as sent once the backend accepted it
+            sent = self.delivery.submit(message)
+            # An outbox drainer can free its slot instead of sitting out the coalesce window
+            handed_off()
+            await sent
+        else:
+            await self._deliver(message)
+
+    async def _deliver(self, message: CommunicationMessage) -> None:
+        """Hand a message to the backend for sending."""
+        await self.api_client.send_communication(
+            customer_id=message.customer_id,
+            comm_type=message.comm_type.value,
+            content=message.content,
+            subject=message.subject,
+            triggered_by=message.triggered_by,
+        )
+
     async def _handle_error(self, state: CommunicationState) -> CommunicationState:
         """Handle errors in the workflow."""
         print(f"[Communication Error] {state.get('error')}")
@@ -254,6 +578,8 @@ async def main():
 
     agent = CommunicationAgent()
     success = await agent.notify_status_change(customer_id, status, return_id)
+    if agent.delivery:
+        await agent.delivery.stop()
     print(f"Communication sent: {success}")
 
 
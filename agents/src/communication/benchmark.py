@@ -0,0 +1,42 @@
+"""
+Template rendering throughput: str.format per message vs precompiled plans.
+
+Usage: python -m src.communication.benchmark [n_messages]
+"""
+
+import sys
+import time
+
+from ..models.communications import DEFAULT_TEMPLATES, DEFAULT_TEMPLATE_VALUES
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    rows = [{"customer_name": f"Customer {i}", "tax_year": 2024} for i in range(n)]
+    defaults = DEFAULT_TEMPLATE_VALUES
+
+    for status, template in DEFAULT_TEMPLATES.items():
+        start = time.perf_counter()
+        for row in rows:
+            values = {**defaults, **row}
+            template.subject_template.format(**values)
+            template.body_template.format(**values)
+        format_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for row in rows:
+            template.render(**defaults, **row)
+        render_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        template.render_many(rows, defaults=defaults)
+        many_time = time.perf_counter() - start
+
+        print(f"{status} ({n:,} messages)")
+        print(f"  str.format:  {n / format_time:>12,.0f} msg/s")
+        print(f"  render:      {n / render_time:>12,.0f} msg/s")
+        print(f"  render_many: {n / many_time:>12,.0f} msg/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+import asyncio
+import json
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+from typing import Awaitable, Callable, List, Optional, TypeVar
+
+from ..shared.config import settings
+from ..shared.firestore_client import bulk_reader
+from ..models.communications import CommunicationMessage, DEFAULT_TEMPLATES, DEFAULT_TEMPLATE_VALUES
+from .agent import CommunicationAgent
+
+T = TypeVar("T")
+
+# How often a running campaign writes its progress
+PROGRESS_SAVE_SECONDS = 2.0
+# A pending/running campaign not saved for this long was cut off by a restart
+STALE_AFTER_SECONDS = 60.0
+
+
+class CampaignStore:
+    """
+    Campaign progress in local SQLite.
+
+    Every worker on the host reads the same file, so a progress poll can be
+    answered by any of them, and finished campaigns survive a restart.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with closing(self._connect()) as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS campaigns (
+                    campaign_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    sent INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    skipped INTEGER NOT NULL DEFAULT 0,
+                    errors TEXT NOT NULL DEFAULT '[]',
+                    started_at REAL NOT NULL,
+                    finished_at REAL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def save(self, progress: dict) -> None:
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO campaigns (campaign_id, status, state, total, sent, failed, skipped, "
+                "errors, started_at, finished_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    progress["campaign_id"],
+                    progress["status"],
+                    progress["state"],
+                    progress["total"],
+                    progress["sent"],
+                    progress["failed"],
+                    progress["skipped"],
+                    json.dumps(progress["errors"]),
+                    progress["started_at"],
+                    progress["finished_at"],
+                    time.time(),
+                ),
+            )
+
+    def get(self, campaign_id: str) -> Optional[dict]:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM campaigns WHERE campaign_id = ?", (campaign_id,)).fetchone()
+        if row is None:
+            return None
+        return {**dict(row), "errors": json.loads(row["errors"])}
+
+
+class CampaignRunner:
+    """
+    Bulk status notifications for many customers at once.
+
+    Instead of one `/communication/notify` workflow per customer, a campaign:
+    1. Fetches the target returns (by filter or ID list) and their customers in bulk
+    2. Renders every message with `CommunicationTemplate.render_many`
+    3. Sends through the communication agent, so the dedup window and the
+       delivery scheduler's rate caps apply as they do to single notifications
+
+    Progress is saved to a CampaignStore while the campaign runs and can be
+    polled by ID from any worker.
+    """
+
+    def __init__(
+        self,
+        communication_agent: Optional[CommunicationAgent] = None,
+        concurrency: Optional[int] = None,
+    ):
+        self.communication_agent = communication_agent or CommunicationAgent()
+        self.api_client = self.communication_agent.api_client
+        self.reader = bulk_reader(self.api_client)
+        self.concurrency = concurrency or settings.campaign_concurrency
+        self.store = CampaignStore(settings.campaign_store_path)
+
+    async def create(self, status: str) -> str:
+        """Register a new campaign for a templated status; returns its ID."""
+        if status not in DEFAULT_TEMPLATES:
+            raise ValueError(f"No template for status '{status}'; campaigns require a template")
+
+        campaign_id = str(uuid.uuid4())
+        progress = {
+            "campaign_id": campaign_id,
+            "status": status,
+            "state": "pending",
+            "total": 0,
+            "sent": 0,
+            "failed": 0,
+            "skipped": 0,
+            "errors": [],
+            "started_at": time.time(),
+            "finished_at": None,
+        }
+        await asyncio.to_thread(self.store.save, progress)
+        return campaign_id
+
+    async def get(self, campaign_id: str) -> Optional[dict]:
+        """Campaign progress; a campaign whose worker stopped mid-run is reported as interrupted."""
+        progress = await asyncio.to_thread(self.store.get, campaign_id)
+        if (
+            progress
+            and progress["state"] in ("pending", "running")
+            and time.time() - progress["updated_at"] > STALE_AFTER_SECONDS
+        ):
+            progress["state"] = "interrupted"
+        return progress
+
+    async def run(
+        self,
+        campaign_id: str,
+        return_ids: Optional[List[str]] = None,
+        return_filter: Optional[dict] = None,
+    ) -> dict:
+        """
+        Run a campaign created with `create`.
+
+        Args:
+            campaign_id: Campaign to run
+            return_ids: Explicit tax return IDs to notify
+            return_filter: /api/returns query (e.g. {"status": "filed", "taxYear": 2024})
+                used when no IDs are given
+
+        Returns:
+            Final campaign progress
+        """
+        progress = await asyncio.to_thread(self.store.get, campaign_id)
+        progress["state"] = "running"
+        template = DEFAULT_TEMPLATES[progress["status"]]
+        finished = asyncio.Event()
+        saver = asyncio.create_task(self._save_until(progress, finished))
+
+        try:
+            # Batched get_all reads with direct Firestore reads, bounded GETs through the API
+            if return_ids:
+                returns = list((await self.reader.get_many("/api/returns", return_ids)).values())
+            else:
+                returns = await self.reader.list_all("/api/returns", params=return_filter or {})
+            returns = [r for r in returns if r.get("customerId")]
+
+            customer_ids = list({r["customerId"] for r in returns})
+            customers_by_id = await self.reader.get_many(
+                "/api/customers",
+                customer_ids,
+                fields=["firstName", "lastName"],
+            )
+
+            recipients = []
+            rows = []
+            for tax_return in returns:
+                customer = customers_by_id.get(tax_return["customerId"])
+                if not customer:
+                    progress["skipped"] += 1
+                    continue
+                recipients.append(tax_return)
+                rows.append({
+                    "customer_name": f"{customer.get('firstName', '')} {customer.get('lastName', '')}".strip(),
+                    "tax_year": tax_return.get("taxYear", "2024"),
+                })
+            progress["total"] = len(recipients)
+
+            messages = [
+                CommunicationMessage(
+                    customer_id=tax_return["customerId"],
+                    comm_type=template.comm_type,
+                    subject=subject,
+                    content=body,
+                    customer_name=row["customer_name"],
+                )
+                for tax_return, row, (subject, body) in zip(
+                    recipients, rows, template.render_many(rows, defaults=DEFAULT_TEMPLATE_VALUES)
+                )
+            ]
+
+            # The delivery scheduler paces its own sends; without it, bound in-flight backend requests
+            delivery = self.communication_agent.delivery
+            limit = len(messages) if delivery and delivery.running else self.concurrency
+            await self._bounded(
+                lambda item: self._send(progress, *item),
+                [(message, tax_return["id"]) for message, tax_return in zip(messages, recipients)],
+                limit,
+            )
+
+            progress["state"] = "completed"
+
+        except Exception as e:
+            progress["state"] = "failed"
+            progress["errors"].append(str(e))
+            print(f"[Campaign] {campaign_id} failed: {e}")
+
+        finally:
+            # Let a save in progress land before the final one
+            finished.set()
+            await saver
+
+        progress["finished_at"] = time.time()
+        await asyncio.to_thread(self.store.save, progress)
+        print(
+            f"[Campaign] {campaign_id} ({progress['status']}): "
+            f"{progress['sent']} sent, {progress['failed']} failed, {progress['skipped']} skipped"
+        )
+        return progress
+
+    async def _save_until(self, progress: dict, finished: asyncio.Event) -> None:
+        """Write progress while the campaign runs, so other workers see it move."""
+        while not finished.is_set():
+            try:
+                await asyncio.to_thread(self.store.save, progress)
+            except Exception as e:
+                print(f"[Campaign] Could not save progress of {progress['campaign_id']}: {e}")
+            try:
+                await asyncio.wait_for(finished.wait(), PROGRESS_SAVE_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _send(self, progress: dict, message: CommunicationMessage, return_id: str) -> None:
+        try:
+            if await self.communication_agent.send_message(message, progress["status"], return_id):
+                progress["sent"] += 1
+            else:
+                # Already notified of this status within the dedup window
+                progress["skipped"] += 1
+        except Exception as e:
+            print(f"[Campaign] Failed to send to {message.customer_id}: {e}")
+            progress["failed"] += 1
+            progress["errors"].append(message.customer_id)
+
+    @staticmethod
+    async def _bounded(func: Callable[..., Awaitable[T]], items: List, limit: int) -> List[T]:
+        """Apply `func` to every item with at most `limit` calls in flight."""
+        semaphore = asyncio.Semaphore(max(limit, 1))
+
+        async def call(item):
+            async with semaphore:
+                return await func(item)
+
+        return await asyncio.gather(*(call(item) for item in items))
@@ -0,0 +1,61 @@
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class DedupWindow:
+    """
+    Suppresses repeat notifications for the same (customer, return, status).
+
+    A key is claimed when a notification starts. Repeats inside the window
+    are suppressed; a failed send releases its claim so retries still go out.
+    """
+
+    def __init__(self, window_seconds: float = 3600.0):
+        self.window_seconds = window_seconds
+        self._claims: OrderedDict[tuple, float] = OrderedDict()
+        self.suppressed = 0
+
+    @staticmethod
+    def key(customer_id: str, return_id: Optional[str], status: str) -> tuple:
+        return (customer_id, return_id or "", status)
+
+    def _prune(self, now: float) -> None:
+        # Claims are kept in time order, so expired ones are at the front
+        while self._claims:
+            key, claimed_at = next(iter(self._claims.items()))
+            if now - claimed_at <= self.window_seconds:
+                break
+            del self._claims[key]
+
+    def seen(self, key: tuple) -> bool:
+        """True if `key` was claimed within the window."""
+        self._prune(time.monotonic())
+        return key in self._claims
+
+    def suppress_if_seen(self, key: tuple) -> bool:
+        """Like `seen`, but counts a suppression when it returns True; doesn't claim `key`."""
+        if not self.seen(key):
+            return False
+        self.suppressed += 1
+        return True
+
+    def claim(self, key: tuple) -> bool:
+        """Claim `key`; returns False (and counts a suppression) for a duplicate."""
+        now = time.monotonic()
+        self._prune(now)
+        if key in self._claims:
+            self.suppressed += 1
+            return False
+        self._claims[key] = now
+        return True
+
+    def release(self, key: tuple) -> None:
+        self._claims.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "window_seconds": self.window_seconds,
+            "active": len(self._claims),
+            "suppressed": self.suppressed,
+        }
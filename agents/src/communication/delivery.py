@@ -0,0 +1,191 @@
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+from zoneinfo import ZoneInfo
+
+from ..models.communications import CommunicationMessage, CommunicationType
+
+
+class TokenBucket:
+    """Allows `rate_per_minute` sends on average, with bursts up to `burst`."""
+
+    def __init__(self, rate_per_minute: float, burst: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = burst or max(1.0, rate_per_minute / 10.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def try_take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+def coalesce(messages: list[CommunicationMessage]) -> CommunicationMessage:
+    """Merge pending messages for one customer into a single message, oldest first."""
+    if len(messages) == 1:
+        return messages[0]
+    latest = messages[-1]
+    return latest.model_copy(update={"content": "\n\n---\n\n".join(m.content for m in messages)})
+
+
+class DeliveryScheduler:
+    """
+    Queues outgoing communications per channel instead of sending immediately.
+
+    - Each channel (email, SMS, call) has its own rate cap, matching provider limits
+    - Messages wait `coalesce_seconds` so several updates for one customer go
+      out as a single message
+    - SMS is held during quiet hours and sent once they end
+    - Failed sends are requeued up to `max_attempts` times
+    - `submit` returns a future that resolves once the backend accepted the
+      message, so callers can confirm delivery rather than just queueing
+    """
+
+    def __init__(
+        self,
+        send: Callable[[CommunicationMessage], Awaitable[object]],
+        rates_per_minute: dict[CommunicationType, float],
+        coalesce_seconds: float = 30.0,
+        quiet_hours: tuple[int, int] = (21, 8),
+        timezone: str = "America/New_York",
+        max_attempts: int = 3,
+        tick_seconds: float = 1.0,
+    ):
+        self.send = send
+        self.buckets = {channel: TokenBucket(rate) for channel, rate in rates_per_minute.items()}
+        self.coalesce_seconds = coalesce_seconds
+        self.quiet_start, self.quiet_end = quiet_hours
+        self.tz = ZoneInfo(timezone)
+        self.max_attempts = max_attempts
+        self.tick_seconds = tick_seconds
+        # channel -> customer_id -> {"messages": [...], "waiters": [...], "queued_at": float, "attempts": int}
+        self._queues: dict[CommunicationType, OrderedDict[str, dict]] = {
+            channel: OrderedDict() for channel in CommunicationType
+        }
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"queued": 0, "coalesced": 0, "sent": 0, "failed": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def submit(self, message: CommunicationMessage) -> asyncio.Future:
+        """
+        Queue a message; merges with anything already pending for that customer and channel.
+
+        Returns:
+            Future resolved when the (possibly coalesced) message is sent, or
+            failed with the last error once out of attempts
+        """
+        waiter = asyncio.get_running_loop().create_future()
+        queue = self._queues[message.comm_type]
+        pending = queue.get(message.customer_id)
+        if pending:
+            pending["messages"].append(message)
+            pending["waiters"].append(waiter)
+            self.stats["coalesced"] += 1
+        else:
+            queue[message.customer_id] = {
+                "messages": [message],
+                "waiters": [waiter],
+                "queued_at": time.monotonic(),
+                "attempts": 0,
+            }
+        self.stats["queued"] += 1
+        return waiter
+
+    def pending_count(self) -> dict:
+        return {channel.value: len(queue) for channel, queue in self._queues.items()}
+
+    def in_quiet_hours(self, now: Optional[datetime] = None) -> bool:
+        hour = (now or datetime.now(self.tz)).hour
+        if self.quiet_start <= self.quiet_end:
+            return self.quiet_start <= hour < self.quiet_end
+        return hour >= self.quiet_start or hour < self.quiet_end
+
+    def _deferred(self, channel: CommunicationType) -> bool:
+        return channel == CommunicationType.SMS and self.in_quiet_hours()
+
+    async def dispatch(self, force: bool = False) -> int:
+        """
+        Send everything that is due and within its channel's rate cap.
+
+        Args:
+            force: Ignore coalescing delays and rate caps (quiet hours still apply)
+
+        Returns:
+            Number of messages handed to `send`
+        """
+        now = time.monotonic()
+        batch = []
+        for channel, queue in self._queues.items():
+            if self._deferred(channel):
+                continue
+            for customer_id in list(queue):
+                pending = queue[customer_id]
+                if not force and now - pending["queued_at"] < self.coalesce_seconds:
+                    # Queue is in arrival order, so nothing later is due either
+                    break
+                if not force and not self.buckets[channel].try_take():
+                    break
+                del queue[customer_id]
+                batch.append(pending)
+
+        await asyncio.gather(*(self._send_pending(pending) for pending in batch))
+        return len(batch)
+
+    async def _send_pending(self, pending: dict) -> None:
+        message = coalesce(pending["messages"])
+        try:
+            await self.send(message)
+            self.stats["sent"] += 1
+            for waiter in pending["waiters"]:
+                if not waiter.done():
+                    waiter.set_result(None)
+        except Exception as e:
+            pending["attempts"] += 1
+            if pending["attempts"] >= self.max_attempts:
+                self.stats["failed"] += 1
+                print(f"[Delivery] Giving up on {message.comm_type.value} to {message.customer_id}: {e}")
+                for waiter in pending["waiters"]:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+                return
+            print(f"[Delivery] Send failed for {message.customer_id}, requeueing: {e}")
+            queue = self._queues[message.comm_type]
+            # Merge with anything queued meanwhile; the retry keeps its place in time
+            newer = queue.pop(message.customer_id, None)
+            if newer:
+                pending["messages"].extend(newer["messages"])
+                pending["waiters"].extend(newer["waiters"])
+            queue[message.customer_id] = pending
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="delivery-scheduler")
+
+    async def stop(self) -> None:
+        """Stop the loop and flush what can be sent now."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.dispatch(force=True)
+        remaining = sum(len(q) for q in self._queues.values())
+        if remaining:
+            print(f"[Delivery] {remaining} message(s) still held for quiet hours at shutdown")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.dispatch()
+            except Exception as e:
+                print(f"[Delivery] Dispatch failed: {e}")
+            await asyncio.sleep(self.tick_seconds)
@@ -0,0 +1,107 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+# Stand-in for the customer's name in cached AI drafts
+CUSTOMER_NAME_TOKEN = "[CUSTOMER_NAME]"
+
+Draft = tuple[str, str]  # (subject, body)
+
+
+def context_hash(additional_context: str) -> str:
+    """Hash context after normalizing case and whitespace, so trivial edits share a draft."""
+    normalized = " ".join(additional_context.lower().split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+def personalize(draft: Draft, customer_name: str) -> Draft:
+    subject, body = draft
+    return (
+        subject.replace(CUSTOMER_NAME_TOKEN, customer_name),
+        body.replace(CUSTOMER_NAME_TOKEN, customer_name),
+    )
+
+
+class MessageCache:
+    """
+    TTL- and size-bounded cache of AI-generated message drafts.
+
+    Drafts are keyed by (status, tax year, context hash) and hold the
+    CUSTOMER_NAME_TOKEN instead of a real name, so one LLM call serves every
+    customer with the same status. Concurrent misses for the same key share
+    a single generation. A generation that yields no reusable draft is
+    cached as a miss for the same TTL, so it isn't retried on every message.
+    """
+
+    def __init__(self, ttl_seconds: float = 86400.0, max_size: int = 256):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        # None drafts are negative entries
+        self._entries: OrderedDict[tuple, tuple[float, Optional[Draft]]] = OrderedDict()
+        self._pending: dict[tuple, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(status: str, tax_year, additional_context: str = "") -> tuple:
+        return (status, str(tax_year), context_hash(additional_context or ""))
+
+    def _lookup(self, key: tuple) -> tuple[bool, Optional[Draft]]:
+        """(found, draft); found with a None draft is a cached miss."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        stored_at, draft = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, draft
+
+    def get(self, key: tuple) -> Optional[Draft]:
+        return self._lookup(key)[1]
+
+    def put(self, key: tuple, draft: Optional[Draft]) -> None:
+        self._entries[key] = (time.monotonic(), draft)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get_or_create(
+        self,
+        key: tuple,
+        create: Callable[[], Awaitable[Optional[Draft]]],
+    ) -> Optional[Draft]:
+        """
+        Return the cached draft, or generate it once with `create`.
+
+        `create` returns None when there is no reusable draft; that result is
+        cached too. Errors aren't cached. Every caller waiting on a
+        generation gets its result, even if the caller that started it is
+        cancelled.
+        """
+        found, draft = self._lookup(key)
+        if found:
+            self.hits += 1
+            return draft
+
+        task = self._pending.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(create())
+            self._pending[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.hits += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key: tuple, task: asyncio.Task) -> None:
+        if self._pending.get(key) is task:
+            del self._pending[key]
+        if not task.cancelled() and task.exception() is None:
+            self.put(key, task.result())
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,87 @@
+import json
+from typing import Optional
+
+
+class MessageStreamParser:
+    """
+    Incrementally splits a streamed "Subject: ... / Body: ..." completion.
+
+    Feed model chunks as they arrive; each call returns the events that became
+    available: ("subject", text) once the subject line is complete, then
+    ("body", delta) for every piece of body text.
+    """
+
+    def __init__(self):
+        self.subject: Optional[str] = None
+        self.body = ""
+        self.in_body = False
+        self._buffer = ""
+
+    def feed(self, chunk: str) -> list[tuple[str, str]]:
+        if self.in_body:
+            return self._body_delta(chunk)
+
+        events = []
+        self._buffer += chunk
+        while not self.in_body and "\n" in self._buffer:
+            line, self._buffer = self._buffer.split("\n", 1)
+            events.extend(self._header_line(line))
+
+        if self.in_body and self._buffer:
+            rest, self._buffer = self._buffer, ""
+            events.extend(self._body_delta(rest))
+        return events
+
+    def finish(self) -> list[tuple[str, str]]:
+        """Flush whatever is buffered when the stream ends."""
+        if self.in_body or not self._buffer:
+            return []
+        line, self._buffer = self._buffer, ""
+        return self._header_line(line)
+
+    def _header_line(self, line: str) -> list[tuple[str, str]]:
+        if line.lower().startswith("subject:"):
+            self.subject = line[8:].strip()
+            return [("subject", self.subject)]
+        if line.lower().startswith("body:"):
+            self.in_body = True
+        return []
+
+    def _body_delta(self, text: str) -> list[tuple[str, str]]:
+        # Drop leading whitespace so the streamed body matches the stripped final body
+        if not self.body:
+            text = text.lstrip()
+        if not text:
+            return []
+        self.body += text
+        return [("body", text)]
+
+
+class TokenFiller:
+    """
+    Replaces `token` in streamed text, holding back a trailing partial match
+    until the next piece shows whether it completes the token.
+    """
+
+    def __init__(self, token: str, replacement: str):
+        self.token = token
+        self.replacement = replacement
+        self._pending = ""
+
+    def feed(self, text: str) -> str:
+        text = (self._pending + text).replace(self.token, self.replacement)
+        self._pending = ""
+        for size in range(min(len(self.token) - 1, len(text)), 0, -1):
+            if self.token.startswith(text[-size:]):
+                text, self._pending = text[:-size], text[-size:]
+                break
+        return text
+
+    def flush(self) -> str:
+        text, self._pending = self._pending, ""
+        return text
+
+
+def sse_event(event: str, data) -> str:
+    """Format one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
@@ -0,0 +1,101 @@
+import asyncio
+from collections import deque
+
+
+def inflight_cost(size: int) -> int:
+    """Bytes a document holds while in the pipeline: the raw file plus its base64 copy."""
+    return size + 4 * ((size + 2) // 3)
+
+
+class ByteBudget:
+    """
+    Admission control by in-flight bytes.
+
+    Documents are admitted in arrival order while their cost fits in the
+    budget; the rest wait. A document larger than the whole budget is admitted
+    once nothing else is in flight, so it can't block forever. Holders are
+    per-run tokens, so two runs of the same document are charged separately.
+    """
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self.in_flight_bytes = 0
+        self._holders: dict[str, int] = {}
+        self._waiters: deque[tuple[int, asyncio.Future]] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _fits(self, cost: int) -> bool:
+        return self.in_flight_bytes + cost <= self.budget_bytes or self.in_flight_bytes == 0
+
+    async def acquire(self, holder: str, cost: int) -> None:
+        """Wait until `cost` bytes fit, then charge them to `holder`."""
+        if holder in self._holders:
+            # Re-admission replaces the earlier charge
+            self.release(holder)
+
+        if not self._waiters and self._fits(cost):
+            self._charge(holder, cost)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (cost, future)
+        self._waiters.append(entry)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+            elif future.done() and not future.cancelled():
+                # Admitted just as we were cancelled; hand the bytes back
+                self.in_flight_bytes -= cost
+                self._wake()
+            raise
+        self._holders[holder] = cost
+
+    def resize(self, holder: str, cost: int) -> None:
+        """
+        Set an admitted holder's charge to `cost` without waiting.
+
+        For bytes that are already in memory (a body streamed without a
+        Content-Length): growing makes later documents queue behind them,
+        shrinking hands the difference back.
+        """
+        current = self._holders.get(holder)
+        if current is None or cost == current:
+            return
+        self._holders[holder] = cost
+        self.in_flight_bytes += cost - current
+        if cost < current:
+            self._wake()
+
+    def release(self, holder: str) -> None:
+        """Return `holder`'s bytes to the budget; safe to call more than once."""
+        cost = self._holders.pop(holder, None)
+        if cost is None:
+            return
+        self.in_flight_bytes -= cost
+        self._wake()
+
+    def _charge(self, holder: str, cost: int) -> None:
+        self.in_flight_bytes += cost
+        self._holders[holder] = cost
+
+    def _wake(self) -> None:
+        # Strict FIFO: stop at the first waiter that doesn't fit
+        while self._waiters and self._fits(self._waiters[0][0]):
+            cost, future = self._waiters.popleft()
+            if future.done():
+                continue
+            self.in_flight_bytes += cost
+            future.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "budget_bytes": self.budget_bytes,
+            "in_flight_bytes": self.in_flight_bytes,
+            "in_flight": len(self._holders),
+            "queued": self.queued,
+        }
@@ -1,24 +1,46 @@
 import asyncio
 import time
-from typing import Optional
+import uuid
+from typing import Any, Awaitable, Callable, List, Optional
 
 from langgraph.graph import StateGraph, END
 from typing_extensions import TypedDict
 
 from ..shared.api_client import APIClient
-from ..models.documents import DocumentExtractionResult, DocumentType
+from ..shared.config import settings
+from ..shared.diff import patch_diff
+from ..shared.executor import run_cpu
+from ..shared.llm_usage import BudgetExceeded, usage
+from ..shared.timing import latency
+from ..models.documents import DocumentExtractionResult, DocumentType, ExtractedDocument
+from .admission import ByteBudget, inflight_cost
+from .duplicates import DuplicateIndex, fingerprint
 from .extractor import DocumentExtractor
 
 
+# Charged up front for a file downloaded without a Content-Length
+UNKNOWN_SIZE_RESERVE_BYTES = 1024 * 1024
+
+
 class OCRState(TypedDict):
     """State for the OCR agent workflow."""
 
     document_id: str
+    admission_token: str
     customer_id: str
+    tax_year: Optional[int]
+    document: Optional[dict]
     file_url: str
     hint_type: Optional[str]
     image_data: Optional[bytes]
+    content_sha256: Optional[str]
+    page_hashes: Optional[List[int]]
+    duplicate_of: Optional[str]
+    # Possible duplicate held for a preparer instead of being extracted
+    needs_review: bool
     extraction_result: Optional[DocumentExtractionResult]
+    # Set when the LLM budget is spent; the run ends without touching the document
+    deferred: bool
     error: Optional[str]
 
 
@@ -40,9 +62,23 @@ class DocumentOCRAgent:
     - Tax Helper OCR: Flat API cost, typically <$50 for same volume
     """
 
-    def __init__(self, api_client: Optional[APIClient] = None):
+    def __init__(
+        self,
+        api_client: Optional[APIClient] = None,
+        on_document_processed: Optional[Callable[..., Awaitable[Any]]] = None,
+    ):
         self.api_client = api_client or APIClient()
         self.extractor = DocumentExtractor()
+        # Bounds memory held by documents between download and end of extraction
+        self.admission = ByteBudget(settings.ocr_inflight_budget_mb * 1024 * 1024)
+        # Fingerprints of processed documents, to catch re-uploads of the same form
+        self.duplicates: Optional[DuplicateIndex] = None
+        if settings.duplicate_detection != "off":
+            self.duplicates = DuplicateIndex(settings.duplicate_index_path, settings.duplicate_max_distance)
+        # Called with (customer_id, tax_year, document_id) after a successful update
+        self.on_document_processed = on_document_processed
+        # Hook runs still in flight; referenced so they aren't garbage-collected mid-run
+        self._hook_tasks: set[asyncio.Task] = set()
         self.workflow = self._build_workflow()
 
     def _build_workflow(self) -> StateGraph:
@@ -50,31 +86,55 @@ class DocumentOCRAgent:
         workflow = StateGraph(OCRState)
 
         # Add nodes
-        workflow.add_node("fetch_document", self._fetch_document)
-        workflow.add_node("download_file", self._download_file)
-        workflow.add_node("extract_data", self._extract_data)
-        workflow.add_node("update_document", self._update_document)
-        workflow.add_node("handle_error", self._handle_error)
+        workflow.add_node("fetch_document", latency.node("fetch_document", self._fetch_document))
+        workflow.add_node("download_file", latency.node("download_file", self._download_file))
+        workflow.add_node("check_duplicate", latency.node("check_duplicate", self._check_duplicate))
+        workflow.add_node("extract_data", latency.node("extract_data", self._extract_data))
+        workflow.add_node("mark_for_review", latency.node("mark_for_review", self._mark_for_review))
+        workflow.add_node("update_document", latency.node("update_document", self._update_document))
+        workflow.add_node("handle_error", latency.node("handle_error", self._handle_error))
 
         # Add edges
         workflow.set_entry_point("fetch_document")
         workflow.add_conditional_edges(
             "fetch_document",
-            lambda s: "download_file" if not s.get("error") else "handle_error",
+            lambda s: self._route(s, "download_file"),
         )
         workflow.add_conditional_edges(
             "download_file",
-            lambda s: "extract_data" if not s.get("error") else "handle_error",
+            lambda s: "check_duplicate" if not s.get("error") else "handle_error",
+        )
+        workflow.add_conditional_edges(
+            "check_duplicate",
+            # A reused extraction goes straight to the update; a held duplicate isn't extracted
+            lambda s: (
+                "mark_for_review"
+                if s.get("needs_review")
+                else "update_document" if s.get("extraction_result") else "extract_data"
+            ),
         )
         workflow.add_conditional_edges(
             "extract_data",
-            lambda s: "update_document" if not s.get("error") else "handle_error",
+            lambda s: self._route(s, "update_document"),
         )
+        workflow.add_edge("mark_for_review", END)
         workflow.add_edge("update_document", END)
         workflow.add_edge("handle_error", END)
 
         return workflow.compile()
 
+    @staticmethod
+    def _route(state: OCRState, next_node: str) -> str:
+        """
+        Where to go after a step that can hit the LLM budget.
+
+        A deferral isn't a failure: the document keeps whatever it has (possibly
+        an earlier good extraction) until process_deferred retries it.
+        """
+        if state.get("deferred"):
+            return END
+        return "handle_error" if state.get("error") else next_node
+
     async def process_document(self, document_id: str) -> DocumentExtractionResult:
         """
         Process a document through the OCR pipeline.
@@ -89,16 +149,26 @@ class DocumentOCRAgent:
 
         initial_state: OCRState = {
             "document_id": document_id,
+            # Byte budget holder for this run; a concurrent run of the same document gets its own
+            "admission_token": str(uuid.uuid4()),
             "customer_id": "",
+            "tax_year": None,
+            "document": None,
             "file_url": "",
             "hint_type": None,
             "image_data": None,
+            "content_sha256": None,
+            "page_hashes": None,
+            "duplicate_of": None,
+            "needs_review": False,
             "extraction_result": None,
+            "deferred": False,
             "error": None,
         }
 
         try:
-            final_state = await self.workflow.ainvoke(initial_state)
+            async with latency.run("document_ocr"):
+                final_state = await self.workflow.ainvoke(initial_state)
 
             if final_state.get("error"):
                 return DocumentExtractionResult(
@@ -109,6 +179,15 @@ class DocumentOCRAgent:
                     processing_time_ms=int((time.time() - start_time) * 1000),
                 )
 
+            if final_state.get("needs_review"):
+                return DocumentExtractionResult(
+                    document_id=document_id,
+                    customer_id=final_state["customer_id"],
+                    success=False,
+                    error_message=f"Held for review as a possible duplicate of {final_state['duplicate_of']}",
+                    processing_time_ms=int((time.time() - start_time) * 1000),
+                )
+
             return final_state["extraction_result"]
 
         except Exception as e:
@@ -120,15 +199,44 @@ class DocumentOCRAgent:
                 processing_time_ms=int((time.time() - start_time) * 1000),
             )
 
+        finally:
+            self.admission.release(initial_state["admission_token"])
+
+    async def process_deferred(self, limit: int = 20) -> int:
+        """
+        Retry documents deferred because the LLM budget was spent.
+
+        Only documents whose customer's budget allows it are taken; any that
+        hit the budget again are re-deferred by the workflow.
+
+        Returns:
+            Number of documents retried
+        """
+        document_ids = await asyncio.to_thread(usage.take_deferred, "ocr_extract", limit)
+        if document_ids:
+            await asyncio.gather(*(self.process_document(document_id) for document_id in document_ids))
+            print(f"[OCR] Retried {len(document_ids)} budget-deferred document(s)")
+        return len(document_ids)
+
     async def _fetch_document(self, state: OCRState) -> OCRState:
         """Fetch document metadata from the API."""
         try:
             doc = await self.api_client.get_document(state["document_id"])
+            # Kept so updates only send what changed
+            state["document"] = doc
             state["customer_id"] = doc.get("customerId", "")
+            state["tax_year"] = doc.get("taxYear")
             state["file_url"] = doc.get("fileUrl", "")
             state["hint_type"] = doc.get("type")
         except Exception as e:
             state["error"] = f"Failed to fetch document: {e}"
+            return state
+
+        # Don't download a file the budget won't let us extract
+        if not await asyncio.to_thread(usage.budget_available, state["customer_id"]):
+            await asyncio.to_thread(usage.defer, "ocr_extract", state["document_id"], state["customer_id"])
+            state["deferred"] = True
+            state["error"] = "Deferred: LLM budget exhausted"
         return state
 
     async def _download_file(self, state: OCRState) -> OCRState:
@@ -143,28 +251,143 @@ class DocumentOCRAgent:
                 state["error"] = "Local files not yet supported - please use Firebase Storage"
                 return state
 
+            max_bytes = settings.max_file_size_mb * 1024 * 1024
+            token = state["admission_token"]
+
             async with httpx.AsyncClient() as client:
-                response = await client.get(file_url)
-                response.raise_for_status()
-                state["image_data"] = response.content
+                async with client.stream("GET", file_url) as response:
+                    response.raise_for_status()
+
+                    # Queue for the byte budget before reading the body; without a
+                    # Content-Length, queue for a first chunk and grow the charge as bytes arrive
+                    declared = int(response.headers.get("content-length") or 0)
+                    if declared > max_bytes:
+                        state["error"] = f"File too large: {declared} bytes (max {settings.max_file_size_mb} MB)"
+                        return state
+                    await self.admission.acquire(token, inflight_cost(declared or UNKNOWN_SIZE_RESERVE_BYTES))
+
+                    chunks = []
+                    received = 0
+                    async for chunk in response.aiter_bytes():
+                        received += len(chunk)
+                        if received > max_bytes:
+                            self.admission.release(token)
+                            state["error"] = f"File too large: over {max_bytes} bytes"
+                            return state
+                        chunks.append(chunk)
+                        if not declared:
+                            self.admission.resize(token, inflight_cost(max(received, UNKNOWN_SIZE_RESERVE_BYTES)))
+
+            content = b"".join(chunks)
+            # Wrong Content-Length - charge what was actually downloaded
+            self.admission.resize(token, inflight_cost(len(content)))
+            state["image_data"] = content
 
         except Exception as e:
+            self.admission.release(state["admission_token"])
             state["error"] = f"Failed to download file: {e}"
         return state
 
+    @staticmethod
+    def _media_type(file_url: str) -> str:
+        """Media type from the file extension."""
+        file_url = file_url.lower()
+        if file_url.endswith(".pdf"):
+            return "application/pdf"
+        if file_url.endswith(".png"):
+            return "image/png"
+        return "image/jpeg"
+
+    async def _check_duplicate(self, state: OCRState) -> OCRState:
+        """
+        Fingerprint the file and look for a duplicate among the customer's processed documents for the year.
+
+        In "review" mode (the default) a duplicate isn't extracted: it is held
+        for a preparer with duplicateOf set, instead of paying for a Vision call
+        whose result is most likely thrown away. "reuse" mode also holds
+        near-duplicates, but gives an exact duplicate the earlier document's
+        current extraction, including any corrections. "flag" mode extracts
+        every document and only sets duplicateOf. A document the preparer
+        marked duplicateReviewed is always extracted.
+        """
+        if not self.duplicates or (state["document"] or {}).get("duplicateReviewed"):
+            return state
+
+        try:
+            sha256, hashes = await run_cpu(fingerprint, state["image_data"], self._media_type(state["file_url"]))
+            state["content_sha256"] = sha256
+            state["page_hashes"] = hashes
+            match = await asyncio.to_thread(
+                self.duplicates.find, state["customer_id"], state["tax_year"], state["document_id"], sha256, hashes
+            )
+        except Exception as e:
+            # Fingerprinting is an optimization; extract normally if it fails
+            print(f"[OCR] Duplicate check failed for {state['document_id']}: {e}")
+            return state
+        if not match:
+            return state
+
+        original_id, exact = match
+        state["duplicate_of"] = original_id
+        kind = "an exact" if exact else "a near"
+        print(f"[OCR] Document {state['document_id']} is {kind}-duplicate of {original_id}")
+        if settings.duplicate_detection == "flag":
+            return state
+
+        original = await self._original(original_id)
+        if original is None:
+            state["duplicate_of"] = None
+            return state
+
+        if exact and settings.duplicate_detection == "reuse":
+            extracted = self._extraction(original)
+            if extracted is None:
+                # Nothing to copy yet; extract this one normally
+                return state
+            note = f"Exact duplicate of document {original_id}; extraction reused"
+            state["extraction_result"] = DocumentExtractionResult(
+                document_id=state["document_id"],
+                customer_id=state["customer_id"],
+                success=True,
+                extracted_data=extracted.model_copy(
+                    update={"notes": f"{extracted.notes}; {note}" if extracted.notes else note}
+                ),
+                processing_time_ms=0,
+            )
+        else:
+            state["needs_review"] = True
+
+        # extract_data is skipped, so free the file here
+        state["image_data"] = None
+        self.admission.release(state["admission_token"])
+        return state
+
+    async def _original(self, document_id: str) -> Optional[dict]:
+        """The earlier document a duplicate matched, or None if it is gone."""
+        try:
+            return await self.api_client.get_document(document_id)
+        except Exception as e:
+            # Most likely deleted; stop matching against it
+            print(f"[OCR] Duplicate original {document_id} unavailable, extracting normally: {e}")
+            await asyncio.to_thread(self.duplicates.remove, document_id)
+            return None
+
+    @staticmethod
+    def _extraction(doc: dict) -> Optional[ExtractedDocument]:
+        """A document's extraction as it stands now, or None if it was never extracted."""
+        if not doc.get("ocrExtracted"):
+            return None
+        try:
+            return ExtractedDocument.model_validate(doc.get("extractedData") or {})
+        except ValueError:
+            return None
+
     async def _extract_data(self, state: OCRState) -> OCRState:
         """Extract data from the document using Claude Vision."""
         try:
             start_time = time.time()
 
-            # Determine media type from file extension
-            file_url = state["file_url"].lower()
-            if file_url.endswith(".pdf"):
-                media_type = "application/pdf"
-            elif file_url.endswith(".png"):
-                media_type = "image/png"
-            else:
-                media_type = "image/jpeg"
+            media_type = self._media_type(state["file_url"])
 
             # Get hint type
             hint_type = None
@@ -176,6 +399,8 @@ class DocumentOCRAgent:
                 state["image_data"],
                 media_type=media_type,
                 hint_document_type=hint_type,
+                document_id=state["document_id"],
+                customer_id=state["customer_id"],
             )
 
             state["extraction_result"] = DocumentExtractionResult(
@@ -186,8 +411,29 @@ class DocumentOCRAgent:
                 processing_time_ms=int((time.time() - start_time) * 1000),
             )
 
+            if self.duplicates and state["page_hashes"] and extracted.confidence_score > 0:
+                await asyncio.to_thread(
+                    self.duplicates.add,
+                    state["customer_id"],
+                    state["tax_year"],
+                    state["document_id"],
+                    state["content_sha256"],
+                    state["page_hashes"],
+                )
+
+        except BudgetExceeded as e:
+            # Queued; process_deferred retries it once the budget allows
+            await asyncio.to_thread(usage.defer, "ocr_extract", state["document_id"], state["customer_id"])
+            state["deferred"] = True
+            state["error"] = f"Deferred: {e}"
+
         except Exception as e:
             state["error"] = f"Failed to extract data: {e}"
+
+        finally:
+            # The file bytes aren't needed past extraction
+            state["image_data"] = None
+            self.admission.release(state["admission_token"])
         return state
 
     async def _update_document(self, state: OCRState) -> OCRState:
@@ -195,25 +441,65 @@ class DocumentOCRAgent:
         try:
             result = state["extraction_result"]
             if result and result.extracted_data:
-                await self.api_client.update_document(
-                    state["document_id"],
+                await self._write_document(
+                    state,
                     {
                         "ocrExtracted": True,
-                        "extractedData": result.extracted_data.model_dump(),
+                        "extractedData": result.extracted_data.model_dump(mode="json"),
                         "status": "processed",
                         "type": result.extracted_data.document_type.value,
+                        "duplicateOf": state["duplicate_of"],
                     },
                 )
         except Exception as e:
             # Don't fail the whole process if update fails
             print(f"Warning: Failed to update document: {e}")
+            return state
+
+        if self.on_document_processed:
+            # Status re-evaluation runs on its own; this document's run doesn't wait for it
+            task = asyncio.create_task(
+                self._run_processed_hook(state["customer_id"], state["tax_year"], state["document_id"])
+            )
+            self._hook_tasks.add(task)
+            task.add_done_callback(self._hook_tasks.discard)
+        return state
+
+    async def _run_processed_hook(self, customer_id: str, tax_year: Optional[int], document_id: str) -> None:
+        try:
+            await self.on_document_processed(customer_id, tax_year, document_id)
+        except Exception as e:
+            print(f"Warning: Document processed hook failed for {document_id}: {e}")
+
+    async def _mark_for_review(self, state: OCRState) -> OCRState:
+        """Leave a possible duplicate pending for a preparer, pointing at the document it matched."""
+        try:
+            await self._write_document(
+                state,
+                {
+                    "ocrExtracted": False,
+                    "status": "pending",
+                    "duplicateOf": state["duplicate_of"],
+                    "needsReview": True,
+                },
+            )
+        except Exception as e:
+            print(f"Warning: Failed to mark document for review: {e}")
         return state
 
+    async def _write_document(self, state: OCRState, desired: dict) -> None:
+        """PATCH only the fields that differ from the fetched document; skip the request if none do."""
+        changes = patch_diff(state["document"] or {}, desired)
+        if not changes:
+            print(f"[OCR] Document {state['document_id']} unchanged, skipping update")
+            return
+        await self.api_client.update_document(state["document_id"], changes)
+
     async def _handle_error(self, state: OCRState) -> OCRState:
         """Handle errors in the workflow."""
         try:
-            await self.api_client.update_document(
-                state["document_id"],
+            await self._write_document(
+                state,
                 {
                     "ocrExtracted": False,
                     "status": "pending",
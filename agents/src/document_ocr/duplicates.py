@@ -0,0 +1,166 @@
+"""
+Near-duplicate detection for uploaded documents.
+
+A photo, a rescan and a PDF of the same W-2 differ byte for byte but look
+alike, so each page gets a 64-bit perceptual hash (DCT pHash). A document is
+a near-duplicate of an earlier one from the same customer and tax year when
+both have the same number of pages and each page is within `max_distance`
+bits of the page in the same position. Perceptual hashes can't tell two
+years' W-2s from the same employer apart, so a near-duplicate is held for a
+preparer to review rather than given the earlier document's data; an exact
+duplicate (same SHA-256) can reuse the earlier document's extraction.
+
+The local SQLite index only holds fingerprints. Extractions are read from
+the earlier document when reused, so preparer corrections carry over.
+"""
+
+import hashlib
+import io
+import sqlite3
+import time
+from contextlib import closing
+from typing import List, Optional
+
+import numpy as np
+
+HASH_SIZE = 8
+_SAMPLE_SIZE = HASH_SIZE * 4
+# Orthonormal DCT-II basis for the downscaled page
+_DCT = np.cos(
+    np.pi * np.outer(np.arange(_SAMPLE_SIZE), 2 * np.arange(_SAMPLE_SIZE) + 1) / (2 * _SAMPLE_SIZE)
+)
+
+
+def _phash(image) -> int:
+    from PIL import Image
+
+    pixels = np.asarray(
+        image.convert("L").resize((_SAMPLE_SIZE, _SAMPLE_SIZE), Image.Resampling.LANCZOS),
+        dtype=np.float64,
+    )
+    low = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE]
+    bits = (low > np.median(low)).flatten()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def page_hashes(data: bytes, media_type: str) -> List[int]:
+    """Perceptual hash of each page; PDFs are rasterized at low resolution first."""
+    from PIL import Image, ImageOps
+
+    if media_type == "application/pdf":
+        from pdf2image import convert_from_bytes
+
+        pages = convert_from_bytes(data, dpi=50)
+    else:
+        # Phone photos carry their rotation in EXIF
+        pages = [ImageOps.exif_transpose(Image.open(io.BytesIO(data)))]
+    return [_phash(page) for page in pages]
+
+
+def fingerprint(data: bytes, media_type: str) -> tuple[str, List[int]]:
+    """(SHA-256 hex digest, page hashes) of a document file."""
+    return hashlib.sha256(data).hexdigest(), page_hashes(data, media_type)
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class DuplicateIndex:
+    """Local SQLite index of processed documents' fingerprints, per customer and tax year."""
+
+    def __init__(self, path: str, max_distance: int = 10):
+        self.path = path
+        self.max_distance = max_distance
+        with closing(self._connect()) as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS document_fingerprints (
+                    document_id TEXT PRIMARY KEY,
+                    customer_id TEXT NOT NULL,
+                    tax_year INTEGER,
+                    content_sha256 TEXT NOT NULL,
+                    page_hashes TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS document_fingerprints_customer "
+                "ON document_fingerprints (customer_id, tax_year)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def add(
+        self,
+        customer_id: str,
+        tax_year: Optional[int],
+        document_id: str,
+        content_sha256: str,
+        hashes: List[int],
+    ) -> None:
+        """Record a processed document (replacing any earlier entry for it)."""
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO document_fingerprints "
+                "(document_id, customer_id, tax_year, content_sha256, page_hashes, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    document_id,
+                    customer_id,
+                    tax_year,
+                    content_sha256,
+                    ",".join(f"{h:016x}" for h in hashes),
+                    time.time(),
+                ),
+            )
+
+    def remove(self, document_id: str) -> None:
+        """Forget a document, e.g. once it has been deleted."""
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM document_fingerprints WHERE document_id = ?", (document_id,))
+
+    def find(
+        self,
+        customer_id: str,
+        tax_year: Optional[int],
+        document_id: str,
+        content_sha256: str,
+        hashes: List[int],
+    ) -> Optional[tuple[str, bool]]:
+        """
+        The earlier document of the customer's for the same tax year that this one duplicates.
+
+        An exact match wins; otherwise the closest document with the same page
+        count whose pages are each within `max_distance` bits of this one's.
+
+        Returns:
+            (document_id, exact) of the match, or None; `exact` means the same file bytes
+        """
+        if not hashes:
+            return None
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT document_id, content_sha256, page_hashes FROM document_fingerprints "
+                "WHERE customer_id = ? AND tax_year IS ? AND document_id != ? ORDER BY created_at",
+                (customer_id, tax_year, document_id),
+            ).fetchall()
+
+        best = None
+        for row in rows:
+            if row["content_sha256"] == content_sha256:
+                return row["document_id"], True
+            candidate = [int(h, 16) for h in row["page_hashes"].split(",")]
+            if len(candidate) != len(hashes):
+                continue
+            # Distance of the worst-matching page
+            distance = max(hamming(h, c) for h, c in zip(hashes, candidate))
+            if distance <= self.max_distance and (best is None or distance < best[0]):
+                best = (distance, row["document_id"])
+        if best is None:
+            return None
+        return best[1], False
@@ -1,10 +1,16 @@
+import asyncio
 import base64
-import re
+import time
 from typing import Optional
 from langchain_anthropic import ChatAnthropic
 from langchain_core.messages import HumanMessage
+from pydantic import BaseModel, ValidationError
 
 from ..shared.config import settings
+from ..shared.executor import run_cpu
+from ..shared.llm_replay import replayable
+from ..shared.llm_usage import usage
+from ..shared.tracing import span
 from ..models.documents import (
     DocumentType,
     ExtractedW2,
@@ -13,6 +19,41 @@ from ..models.documents import (
 )
 
 
+def compact_schema(model: type[BaseModel], exclude: tuple[str, ...] = ()) -> dict:
+    """
+    JSON schema for a flat model with titles, defaults and descriptions stripped.
+
+    Every schema token is re-read on each call, so tool schemas carry only
+    field names and types; the prompt covers what the fields mean.
+    """
+    properties = {}
+    for name, prop in model.model_json_schema()["properties"].items():
+        if name in exclude:
+            continue
+        variants = prop.get("anyOf", [prop])
+        types = [variant["type"] for variant in variants if "type" in variant]
+        properties[name] = {"type": types[0] if len(types) == 1 else types}
+    return {"type": "object", "properties": properties}
+
+
+EXTRACTION_TOOL = {
+    "name": "record_extraction",
+    "description": "Record the data extracted from the tax document.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "document_type": {"type": "string", "enum": [t.value for t in DocumentType]},
+            "confidence_score": {"type": "number"},
+            "tax_year": {"type": ["integer", "null"]},
+            "notes": {"type": ["string", "null"]},
+            "w2": compact_schema(ExtractedW2, exclude=("tax_year",)),
+            "form_1099": compact_schema(Extracted1099, exclude=("form_type", "tax_year")),
+        },
+        "required": ["document_type", "confidence_score"],
+    },
+}
+
+
 class DocumentExtractor:
     """
     Extracts structured data from tax documents using Claude Vision.
@@ -26,17 +67,27 @@ class DocumentExtractor:
 
     def __init__(self, model_name: Optional[str] = None):
         self.model_name = model_name or settings.ocr_model
-        self.llm = ChatAnthropic(
-            model=self.model_name,
-            api_key=settings.anthropic_api_key,
-            max_tokens=4096,
-        )
+        self.fallback_model_name = settings.ocr_fallback_model
+        self._llms: dict = {}
+
+    def _llm(self, model_name: str):
+        """Tool-bound client for `model_name`, created on first use."""
+        if model_name not in self._llms:
+            client = ChatAnthropic(
+                model=model_name,
+                api_key=settings.anthropic_api_key,
+                max_tokens=1024,
+            ).bind_tools([EXTRACTION_TOOL], tool_choice=EXTRACTION_TOOL["name"])
+            self._llms[model_name] = replayable(client, model_name)
+        return self._llms[model_name]
 
     async def extract_from_image(
         self,
         image_data: bytes,
         media_type: str = "image/jpeg",
         hint_document_type: Optional[DocumentType] = None,
+        document_id: Optional[str] = None,
+        customer_id: Optional[str] = None,
     ) -> ExtractedDocument:
         """
         Extract structured data from a document image.
@@ -45,12 +96,22 @@ class DocumentExtractor:
             image_data: Raw image bytes
             media_type: MIME type (image/jpeg, image/png, application/pdf)
             hint_document_type: Optional hint about expected document type
+            document_id: Document the call is billed to in the usage ledger
+            customer_id: Customer the call is billed to in the usage ledger
 
         Returns:
             ExtractedDocument with structured data
+
+        Raises:
+            BudgetExceeded: The LLM budget is spent; nothing was sent
         """
-        # Encode image to base64
-        base64_image = base64.standard_b64encode(image_data).decode("utf-8")
+        # Falls back to a cheaper model near the budget, raises once it is spent
+        model_name = await asyncio.to_thread(
+            usage.choose_model, self.model_name, self.fallback_model_name, customer_id
+        )
+
+        # Encode image to base64 (off the event loop)
+        base64_image = await run_cpu(encode_image, image_data)
 
         # Build the prompt
         prompt = self._build_extraction_prompt(hint_document_type)
@@ -71,11 +132,21 @@ class DocumentExtractor:
         )
 
         # Call Claude Vision
-        response = await self.llm.ainvoke([message])
-        response_text = response.content
+        started = time.monotonic()
+        with span("llm ocr_extract", {"llm.model": model_name, "llm.input_bytes": len(image_data)}) as current:
+            response = await self._llm(model_name).ainvoke([message])
+            cost = await asyncio.to_thread(
+                usage.record,
+                "ocr_extract",
+                model_name,
+                response,
+                time.monotonic() - started,
+                document_id=document_id,
+                customer_id=customer_id,
+            )
+            current.set_attribute("llm.cost_usd", cost)
 
-        # Parse the response
-        return self._parse_extraction_response(response_text, hint_document_type)
+        return decode_extraction(response.tool_calls, hint_document_type)
 
     def _build_extraction_prompt(self, hint_type: Optional[DocumentType]) -> str:
         """Build the extraction prompt for Claude."""
@@ -83,129 +154,47 @@ class DocumentExtractor:
         if hint_type:
             type_hint = f"This document is expected to be a {hint_type.value} form. "
 
-        return f"""You are an expert tax document processor. {type_hint}Analyze this tax document image and extract all relevant information.
-
-First, identify the document type:
-- W-2: Wage and Tax Statement
-- 1099-R: Distributions from Pensions, Annuities, IRAs, etc.
-- 1099-G: Government Payments (unemployment, state refunds)
-- 1099-INT: Interest Income
-- 1099-DIV: Dividends and Distributions
-- 1099-NEC: Nonemployee Compensation
-- K-1: Partner's/Shareholder's Share of Income
-- Other: Any other tax document
-
-Then extract the following information in a structured format:
-
-For W-2:
-- Employer information (name, EIN, address)
-- Employee information (name, last 4 of SSN, address)
-- Box 1: Wages
-- Box 2: Federal tax withheld
-- Box 3-6: Social Security and Medicare wages/taxes
-- Box 15-17: State information
-
-For 1099 forms:
-- Payer information
-- Recipient information (last 4 of SSN only)
-- All relevant box amounts based on form type
+        return f"""You are an expert tax document processor. {type_hint}Analyze this tax document image and record its data with the record_extraction tool.
 
-IMPORTANT:
-- Only extract the last 4 digits of any SSN for security
-- If a field is not visible or unclear, mark it as null
-- Include a confidence score (0-1) for your overall extraction
-- Note any warnings or issues with the document quality
-
-Respond in this exact JSON format:
-{{
-  "document_type": "w2|1099-r|1099-g|1099-int|1099-div|1099-nec|k1|other",
-  "confidence_score": 0.95,
-  "tax_year": 2024,
-  "notes": "any warnings or issues",
-  "extracted_fields": {{
-    // fields specific to document type
-  }}
-}}"""
-
-    def _parse_extraction_response(
-        self,
-        response_text: str,
-        hint_type: Optional[DocumentType],
-    ) -> ExtractedDocument:
-        """Parse Claude's response into structured data."""
-        import json
-
-        # Try to extract JSON from response
-        try:
-            # Find JSON in response (may be wrapped in markdown code blocks)
-            json_match = re.search(r"\{[\s\S]*\}", response_text)
-            if not json_match:
-                raise ValueError("No JSON found in response")
-
-            data = json.loads(json_match.group())
-        except (json.JSONDecodeError, ValueError) as e:
-            return ExtractedDocument(
-                document_type=hint_type or DocumentType.OTHER,
-                confidence_score=0.0,
-                notes=f"Failed to parse extraction response: {e}",
-                raw_text=response_text[:1000],
-            )
+Document types: w2 (W-2), 1099-r, 1099-g (unemployment, state refunds), 1099-int, 1099-div, 1099-nec, k1, other.
+
+For a W-2, fill "w2": employer name/EIN/address, employee name/address, wages (Box 1), federal tax withheld (Box 2), social security and Medicare wages/taxes (Boxes 3-6), state, state wages and state tax withheld (Boxes 15-17).
+
+For a 1099, fill "form_1099": payer name/TIN, recipient name and the box amounts relevant to the form type.
 
-        # Determine document type
-        doc_type_str = data.get("document_type", "other").lower()
-        doc_type_map = {
-            "w2": DocumentType.W2,
-            "w-2": DocumentType.W2,
-            "1099-r": DocumentType.FORM_1099_R,
-            "1099-g": DocumentType.FORM_1099_G,
-            "1099-int": DocumentType.FORM_1099_INT,
-            "1099-div": DocumentType.FORM_1099_DIV,
-            "1099-nec": DocumentType.FORM_1099_NEC,
-            "k1": DocumentType.K1,
-            "k-1": DocumentType.K1,
-        }
-        document_type = doc_type_map.get(doc_type_str, DocumentType.OTHER)
-
-        # Extract fields based on type
-        fields = data.get("extracted_fields", {})
+IMPORTANT:
+- Only record the last 4 digits of any SSN
+- Amounts are plain numbers (no $ or commas)
+- Use null for fields that are not visible or unclear
+- confidence_score (0-1) is your confidence in the overall extraction
+- Use notes for warnings or document quality issues"""
+
+
+def encode_image(image_data: bytes) -> str:
+    """Base64-encode image bytes for the vision API."""
+    return base64.standard_b64encode(image_data).decode("utf-8")
+
+
+def decode_extraction(
+    tool_calls: list[dict],
+    hint_type: Optional[DocumentType],
+) -> ExtractedDocument:
+    """Build an ExtractedDocument from the record_extraction tool call."""
+    try:
+        if not tool_calls:
+            raise ValueError("No record_extraction tool call in response")
+        data = tool_calls[0]["args"]
+
+        document_type = DocumentType(data.get("document_type", DocumentType.OTHER.value))
+        tax_year = data.get("tax_year")
         w2_data = None
         form_1099_data = None
 
-        if document_type == DocumentType.W2:
-            w2_data = ExtractedW2(
-                employer_name=fields.get("employer_name"),
-                employer_ein=fields.get("employer_ein"),
-                employer_address=fields.get("employer_address"),
-                employee_name=fields.get("employee_name"),
-                employee_ssn=fields.get("employee_ssn_last4"),
-                employee_address=fields.get("employee_address"),
-                wages=self._parse_amount(fields.get("wages")),
-                federal_tax_withheld=self._parse_amount(fields.get("federal_tax_withheld")),
-                social_security_wages=self._parse_amount(fields.get("social_security_wages")),
-                social_security_tax=self._parse_amount(fields.get("social_security_tax")),
-                medicare_wages=self._parse_amount(fields.get("medicare_wages")),
-                medicare_tax=self._parse_amount(fields.get("medicare_tax")),
-                state=fields.get("state"),
-                state_wages=self._parse_amount(fields.get("state_wages")),
-                state_tax_withheld=self._parse_amount(fields.get("state_tax_withheld")),
-                tax_year=data.get("tax_year"),
-            )
-        elif document_type.value.startswith("1099"):
-            form_1099_data = Extracted1099(
-                form_type=document_type.value,
-                payer_name=fields.get("payer_name"),
-                payer_tin=fields.get("payer_tin"),
-                recipient_name=fields.get("recipient_name"),
-                recipient_ssn=fields.get("recipient_ssn_last4"),
-                gross_distribution=self._parse_amount(fields.get("gross_distribution")),
-                taxable_amount=self._parse_amount(fields.get("taxable_amount")),
-                federal_tax_withheld=self._parse_amount(fields.get("federal_tax_withheld")),
-                interest_income=self._parse_amount(fields.get("interest_income")),
-                ordinary_dividends=self._parse_amount(fields.get("ordinary_dividends")),
-                qualified_dividends=self._parse_amount(fields.get("qualified_dividends")),
-                nonemployee_compensation=self._parse_amount(fields.get("nonemployee_compensation")),
-                unemployment_compensation=self._parse_amount(fields.get("unemployment_compensation")),
-                tax_year=data.get("tax_year"),
+        if document_type == DocumentType.W2 and data.get("w2"):
+            w2_data = ExtractedW2.model_validate({**data["w2"], "tax_year": tax_year})
+        elif document_type.value.startswith("1099") and data.get("form_1099"):
+            form_1099_data = Extracted1099.model_validate(
+                {**data["form_1099"], "form_type": document_type.value, "tax_year": tax_year}
             )
 
         return ExtractedDocument(
@@ -215,19 +204,10 @@ Respond in this exact JSON format:
             confidence_score=data.get("confidence_score", 0.0),
             notes=data.get("notes"),
         )
-
-    @staticmethod
-    def _parse_amount(value) -> Optional[float]:
-        """Parse an amount string to float."""
-        if value is None:
-            return None
-        if isinstance(value, (int, float)):
-            return float(value)
-        if isinstance(value, str):
-            # Remove currency symbols, commas
-            cleaned = re.sub(r"[,$]", "", value.strip())
-            try:
-                return float(cleaned)
-            except ValueError:
-                return None
-        return None
+    except (ValidationError, ValueError, KeyError) as e:
+        return ExtractedDocument(
+            document_type=hint_type or DocumentType.OTHER,
+            confidence_score=0.0,
+            notes=f"Failed to decode extraction: {e}",
+            raw_text=str(tool_calls)[:1000],
+        )
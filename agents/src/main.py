@@ -4,24 +4,101 @@ FastAPI server for TaxHelper AI Agents.
 Exposes REST endpoints for triggering agent workflows.
 """
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+import asyncio
+import hmac
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, Header, Query, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
+from typing import Literal, Optional
 
 from .document_ocr import DocumentOCRAgent
-from .communication import CommunicationAgent
+from .communication import CommunicationAgent, CampaignRunner
+from .communication.streaming import sse_event
 from .status_tracker import StatusTrackerAgent
+from .shared.config import settings
+from .shared.executor import get_executor, shutdown_executor
+from .shared.llm_usage import BudgetExceeded, usage
+from .shared.loop_monitor import loop_lag
+from .shared.scheduler import LeaderLock, Scheduler
+from .shared.memory import MemoryMiddleware, memory
+from .shared.ndjson import ndjson_response, wants_ndjson
+from .shared.profiling import profile_event_loop, profile_in_progress
+from .shared.timing import latency
+from .shared.tracing import TracingMiddleware, setup_tracing
+
+setup_tracing()
+memory.start()
+
+# Initialize agents
+communication_agent = CommunicationAgent()
+# Campaign sends share the agent's dedup window and delivery rate caps
+campaign_runner = CampaignRunner(communication_agent)
+# One communication agent, so dedup, drafts and rate caps are shared and its
+# delivery loop (started in the lifespan) is the one outbox notifications use
+status_tracker = StatusTrackerAgent(communication_agent.api_client, communication_agent=communication_agent)
+# Processed documents feed straight back into the status tracker
+ocr_agent = DocumentOCRAgent(on_document_processed=status_tracker.handle_document_event)
+
+
+def build_scheduler() -> Scheduler:
+    """Periodic deadline/extension scans, deferred OCR retries and status sweeps."""
+    scheduler = Scheduler(LeaderLock(settings.scheduler_lock_file), jitter=settings.scheduler_jitter)
+    scheduler.add_job(
+        "deadline_scan",
+        lambda: status_tracker.scan_returns(force=True),
+        interval_seconds=settings.deadline_scan_interval_seconds,
+        timeout_seconds=settings.scheduler_job_timeout_seconds,
+    )
+    scheduler.add_job(
+        "ocr_deferred",
+        ocr_agent.process_deferred,
+        interval_seconds=settings.ocr_deferred_interval_seconds,
+        timeout_seconds=settings.scheduler_job_timeout_seconds,
+    )
+    scheduler.add_job(
+        "status_sweep",
+        status_tracker.sweep_statuses,
+        interval_seconds=settings.status_sweep_interval_seconds,
+        timeout_seconds=settings.scheduler_job_timeout_seconds,
+    )
+    return scheduler
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start pool workers before traffic arrives rather than on the first document
+    get_executor()
+    loop_lag.interval = settings.loop_lag_interval_seconds
+    loop_lag.start()
+    scheduler = build_scheduler() if settings.scheduler_enabled else None
+    if scheduler:
+        scheduler.start()
+    # Every worker delivers the messages it queued itself
+    if communication_agent.delivery:
+        communication_agent.delivery.start()
+    # Outbox claims are transactional, so every worker drains, scheduler or not
+    status_tracker.outbox_drainer.start(settings.outbox_drain_interval_seconds)
+    yield
+    if scheduler:
+        await scheduler.stop()
+    # Flush the delivery queue first so queued outbox entries can record their result
+    if communication_agent.delivery:
+        await communication_agent.delivery.stop()
+    await status_tracker.outbox_drainer.stop()
+    await loop_lag.stop()
+    shutdown_executor()
+
 
 app = FastAPI(
     title="TaxHelper AI Agents",
     description="AI agents for document OCR, communication, and status tracking",
     version="1.0.0",
+    lifespan=lifespan,
 )
-
-# Initialize agents
-ocr_agent = DocumentOCRAgent()
-communication_agent = CommunicationAgent()
-status_tracker = StatusTrackerAgent()
+app.add_middleware(MemoryMiddleware)
+app.add_middleware(TracingMiddleware)
 
 
 class OCRRequest(BaseModel):
@@ -34,14 +111,109 @@ class CommunicationRequest(BaseModel):
     return_id: Optional[str] = None
 
 
+class CampaignRequest(BaseModel):
+    status: str
+    return_ids: Optional[list[str]] = None
+    return_filter: Optional[dict] = None  # /api/returns query, e.g. {"status": "filed"}
+
+
 class StatusCheckRequest(BaseModel):
     return_id: str
 
 
+class ReevaluateRequest(BaseModel):
+    apply: bool = False
+
+
+class DocumentEventRequest(BaseModel):
+    customer_id: str
+    event: Literal["document_created", "document_processed"] = "document_processed"
+    document_id: Optional[str] = None
+    tax_year: Optional[int] = None
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
-    return {"status": "healthy", "service": "taxhelper-agents"}
+    return {"status": "healthy", "service": "taxhelper-agents", "event_loop_lag_ms": loop_lag.stats()}
+
+
+def require_debug_token(x_debug_token: str = Header("")):
+    """Debug endpoints are hidden unless DEBUG_TOKEN is set and sent as X-Debug-Token."""
+    if not settings.debug_token:
+        raise HTTPException(status_code=404, detail="Not found")
+    # Constant-time comparison, so response timing doesn't leak the token
+    if not hmac.compare_digest(x_debug_token.encode(), settings.debug_token.encode()):
+        raise HTTPException(status_code=403, detail="Invalid debug token")
+
+
+@app.get("/debug/profile", dependencies=[Depends(require_debug_token)])
+async def cpu_profile(
+    seconds: float = Query(10, gt=0),
+    interval_ms: float = Query(5, ge=1, le=100),
+):
+    """
+    Sample the live event loop and worker threads and return collapsed stacks for flame graphs.
+
+    Stacks are rooted at event-loop, cpu (run_cpu's thread pool) or asyncio
+    (asyncio.to_thread). With CPU_EXECUTOR=process, run_cpu work happens in
+    other processes and is missing; the X-Profile-Coverage header says so.
+    Feed the result to flamegraph.pl or speedscope.
+    """
+    if seconds > settings.profile_max_seconds:
+        raise HTTPException(status_code=400, detail=f"seconds must be <= {settings.profile_max_seconds}")
+    if profile_in_progress():
+        raise HTTPException(status_code=409, detail="A profile is already running")
+
+    collapsed = await profile_event_loop(seconds, interval_ms / 1000)
+    coverage = "event-loop, cpu, asyncio"
+    if settings.cpu_executor == "process":
+        coverage = "event-loop, asyncio; run_cpu work runs in worker processes and is not sampled"
+    return PlainTextResponse(
+        collapsed,
+        headers={
+            "Content-Disposition": 'attachment; filename="agents-profile.collapsed"',
+            "X-Profile-Coverage": coverage,
+        },
+    )
+
+
+@app.get("/debug/memory", dependencies=[Depends(require_debug_token)])
+async def memory_report(limit: int = Query(20, ge=1, le=200)):
+    """
+    RSS gauges, top allocation sites, sampled request peaks and per-stage retained memory.
+    """
+    return memory.report(limit)
+
+
+@app.post("/debug/memory/snapshot", dependencies=[Depends(require_debug_token)])
+async def memory_snapshot():
+    """
+    Store a tracemalloc snapshot as the baseline for /debug/memory/diff.
+    """
+    if not memory.tracing:
+        raise HTTPException(status_code=400, detail="Memory tracing is disabled (MEMORY_TRACING_ENABLED)")
+    memory.take_baseline()
+    return {"status": "ok", **memory.gauges()}
+
+
+@app.get("/debug/memory/diff", dependencies=[Depends(require_debug_token)])
+async def memory_diff(limit: int = Query(20, ge=1, le=200)):
+    """
+    Allocation sites that grew most since the baseline snapshot.
+    """
+    diff = memory.diff(limit)
+    if diff is None:
+        raise HTTPException(status_code=400, detail="Take a baseline with POST /debug/memory/snapshot first")
+    return diff
+
+
+@app.get("/debug/latency", dependencies=[Depends(require_debug_token)])
+async def latency_report():
+    """
+    Per-workflow node latencies and the critical path of the latest run.
+    """
+    return latency.report()
 
 
 @app.post("/ocr/process")
@@ -59,6 +231,23 @@ async def process_document(request: OCRRequest, background_tasks: BackgroundTask
     }
 
 
+@app.get("/ocr/admission")
+async def ocr_admission():
+    """
+    In-flight byte budget for the OCR pipeline: bytes admitted, documents running and queued.
+    """
+    return ocr_agent.admission.stats()
+
+
+@app.get("/llm/usage")
+async def llm_usage(day: Optional[str] = Query(None, description="UTC day, YYYY-MM-DD; defaults to today")):
+    """
+    LLM tokens, latency and estimated cost for a day, by operation, model,
+    customer and document, with budget state and deferred work.
+    """
+    return await asyncio.to_thread(usage.report, day)
+
+
 @app.post("/ocr/process-sync")
 async def process_document_sync(request: OCRRequest):
     """
@@ -78,13 +267,38 @@ async def process_document_sync(request: OCRRequest):
     }
 
 
+async def notify_or_park(customer_id: str, status: str, return_id: Optional[str] = None) -> None:
+    """Send a notification now, or park it in the outbox while the LLM budget is spent."""
+    try:
+        await communication_agent.notify_status_change(customer_id, status, return_id)
+    except BudgetExceeded as e:
+        print(f"[Communication] {e}; '{status}' notification for {customer_id} parked in the outbox")
+        await asyncio.to_thread(
+            status_tracker.outbox.enqueue,
+            customer_id=customer_id,
+            status=status,
+            return_id=return_id,
+        )
+
+
 @app.post("/communication/notify")
 async def send_notification(request: CommunicationRequest, background_tasks: BackgroundTasks):
     """
     Send a status change notification to a customer.
+
+    Repeats within the dedup window are reported as duplicates and not queued.
     """
+    dedup = communication_agent.dedup
+    if dedup.suppress_if_seen(dedup.key(request.customer_id, request.return_id, request.status)):
+        return {
+            "status": "duplicate",
+            "customer_id": request.customer_id,
+            "message": f"Notification for status '{request.status}' already sent recently",
+            "suppressed_total": dedup.suppressed,
+        }
+
     background_tasks.add_task(
-        communication_agent.notify_status_change,
+        notify_or_park,
         request.customer_id,
         request.status,
         request.return_id,
@@ -96,6 +310,91 @@ async def send_notification(request: CommunicationRequest, background_tasks: Bac
     }
 
 
+@app.get("/communication/dedup")
+async def notification_dedup_stats():
+    """
+    Notification dedup window stats, including how many repeats were suppressed.
+    """
+    return communication_agent.dedup.stats()
+
+
+@app.get("/communication/delivery")
+async def delivery_status():
+    """
+    Pending messages per channel and delivery counters.
+    """
+    delivery = communication_agent.delivery
+    if not delivery:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "pending": delivery.pending_count(),
+        "quiet_hours": delivery.in_quiet_hours(),
+        **delivery.stats,
+    }
+
+
+@app.post("/communication/preview/stream")
+async def stream_message_preview(request: CommunicationRequest):
+    """
+    Stream a message preview over server-sent events.
+
+    Emits "subject" and incremental "body" events, then "done" (or "error").
+    """
+
+    async def events():
+        async for event, data in communication_agent.stream_preview(
+            request.customer_id,
+            request.status,
+            request.return_id,
+        ):
+            yield sse_event(event, data)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/communication/campaign")
+async def start_campaign(request: CampaignRequest, background_tasks: BackgroundTasks):
+    """
+    Notify every customer matching a return filter or ID list.
+
+    Runs in background; poll /communication/campaign/{campaign_id} for progress.
+    """
+    if not request.return_ids and not request.return_filter:
+        raise HTTPException(status_code=400, detail="return_ids or return_filter is required")
+
+    try:
+        campaign_id = await campaign_runner.create(request.status)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    background_tasks.add_task(
+        campaign_runner.run,
+        campaign_id,
+        request.return_ids,
+        request.return_filter,
+    )
+    return {"status": "queued", "campaign_id": campaign_id}
+
+
+@app.get("/communication/campaign/{campaign_id}")
+async def get_campaign(campaign_id: str):
+    """
+    Progress of a notification campaign.
+
+    State is pending, running, completed, failed, or interrupted when the
+    worker running it stopped before it finished.
+    """
+    progress = await campaign_runner.get(campaign_id)
+    if not progress:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    return progress
+
+
 @app.post("/status/check")
 async def check_return_status(request: StatusCheckRequest):
     """
@@ -112,20 +411,95 @@ async def check_return_status(request: StatusCheckRequest):
     }
 
 
+@app.get("/status/outbox")
+async def outbox_status():
+    """
+    Count notification outbox entries by state (pending / dead).
+    """
+    return {"outbox": await asyncio.to_thread(status_tracker.outbox.counts)}
+
+
+@app.post("/status/document-event")
+async def document_event(request: DocumentEventRequest, background_tasks: BackgroundTasks):
+    """
+    Ingest a document-created/processed event.
+
+    Re-evaluates only the returns for that customer and tax year that the
+    event can advance, in background.
+    """
+    background_tasks.add_task(
+        status_tracker.handle_document_event,
+        request.customer_id,
+        request.tax_year,
+        request.document_id,
+        request.event,
+    )
+    return {
+        "status": "queued",
+        "event": request.event,
+        "customer_id": request.customer_id,
+        "tax_year": request.tax_year,
+    }
+
+
+@app.post("/status/reevaluate")
+async def reevaluate_statuses(request: ReevaluateRequest):
+    """
+    Re-evaluate every return against the status rules in one batch.
+
+    Use after changing the rules; set apply to write the new statuses. Writes
+    that fail are listed under "failed" and the rest are still applied.
+    """
+    transitions = await status_tracker.reevaluate_all(apply=request.apply)
+    response = {"transitions": transitions, "count": len(transitions), "apply": request.apply}
+    if request.apply:
+        response["applied"] = sum(1 for transition in transitions if transition["applied"])
+        response["failed"] = [
+            {"return_id": transition["return_id"], "error": transition["error"]}
+            for transition in transitions
+            if not transition["applied"]
+        ]
+    return response
+
+
+@app.get("/status/overview")
+async def status_overview():
+    """
+    Deadline alerts, extension candidates and status counts from one scan.
+    """
+    scan = await status_tracker.scan_returns()
+    return {
+        "alerts": scan["alerts"],
+        "extensions_needed": scan["extensions_needed"],
+        "status_counts": scan["status_counts"],
+        "generated_at": scan["generated_at"],
+    }
+
+
 @app.get("/status/deadlines")
-async def check_deadlines():
+async def check_deadlines(request: Request):
     """
     Check all returns for upcoming deadlines.
+
+    Send `Accept: application/x-ndjson` to stream one alert per line as it is
+    computed (gzip-compressed with `Accept-Encoding: gzip`). A stream that
+    fails part way ends with an {"error": ...} line.
     """
+    if wants_ndjson(request):
+        return ndjson_response(request, status_tracker.iter_scan("alerts"))
     alerts = await status_tracker.check_deadlines()
     return {"alerts": alerts, "count": len(alerts)}
 
 
 @app.get("/status/extensions-needed")
-async def check_extensions():
+async def check_extensions(request: Request):
     """
     Identify returns that need extensions filed.
+
+    Supports `Accept: application/x-ndjson` streaming like /status/deadlines.
     """
+    if wants_ndjson(request):
+        return ndjson_response(request, status_tracker.iter_scan("extensions_needed"))
     extensions = await status_tracker.identify_extensions_needed()
     return {"extensions_needed": extensions, "count": len(extensions)}
 
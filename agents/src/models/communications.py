@@ -1,6 +1,7 @@
 from enum import Enum
-from typing import Optional
-from pydantic import BaseModel, Field
+from string import Formatter
+from typing import Iterable, Mapping, Optional
+from pydantic import BaseModel, Field, PrivateAttr, field_validator
 
 
 class CommunicationType(str, Enum):
@@ -9,6 +10,56 @@ class CommunicationType(str, Enum):
     CALL = "call"
 
 
+# Values the communication agent supplies when rendering a template
+TEMPLATE_PLACEHOLDERS = {"customer_name", "tax_year", "missing_items", "refund_info"}
+
+# Fallback values for placeholders that aren't derived from the customer or return
+DEFAULT_TEMPLATE_VALUES = {
+    "missing_items": "- Please check with our office",
+    "refund_info": "Please check your return documents for refund details.",
+}
+
+
+class RenderPlan:
+    """
+    A template pre-split into literal text and placeholder names.
+
+    Parsing happens once; rendering is a join over the stored pieces.
+    Only plain named placeholders ({name}) are supported.
+    """
+
+    __slots__ = ("pieces", "placeholders")
+
+    def __init__(self, template: str):
+        pieces = []
+        for literal, field, format_spec, conversion in Formatter().parse(template):
+            if field is not None and (not field.isidentifier() or format_spec or conversion):
+                raise ValueError(f"Unsupported placeholder {{{field}}} in template")
+            pieces.append((literal, field))
+        self.pieces: tuple[tuple[str, Optional[str]], ...] = tuple(pieces)
+        self.placeholders = frozenset(field for _, field in pieces if field is not None)
+
+    def render(self, values: Mapping) -> str:
+        out = []
+        for literal, field in self.pieces:
+            out.append(literal)
+            if field is not None:
+                out.append(str(values[field]))
+        return "".join(out)
+
+    def render_many(self, rows: list[Mapping]) -> list[str]:
+        """Render every row column by column: one pass per placeholder, then a join per row."""
+        columns = []
+        for literal, field in self.pieces:
+            if literal:
+                columns.append([literal] * len(rows))
+            if field is not None:
+                columns.append([str(row[field]) for row in rows])
+        if not columns:
+            return [""] * len(rows)
+        return ["".join(parts) for parts in zip(*columns)]
+
+
 class CommunicationTemplate(BaseModel):
     """Template for automated communications."""
 
@@ -19,12 +70,61 @@ class CommunicationTemplate(BaseModel):
     body_template: str = Field(..., description="Message body template with placeholders")
     comm_type: CommunicationType = CommunicationType.EMAIL
 
+    _subject_plan: Optional[RenderPlan] = PrivateAttr(None)
+    _body_plan: RenderPlan = PrivateAttr()
+
+    @field_validator("subject_template", "body_template")
+    @classmethod
+    def _validate_placeholders(cls, value: Optional[str]) -> Optional[str]:
+        if value is not None:
+            RenderPlan(value)
+        return value
+
+    def model_post_init(self, __context) -> None:
+        self._subject_plan = RenderPlan(self.subject_template) if self.subject_template else None
+        self._body_plan = RenderPlan(self.body_template)
+
+    @property
+    def placeholders(self) -> frozenset:
+        """Every placeholder used by the subject and body."""
+        subject = self._subject_plan.placeholders if self._subject_plan else frozenset()
+        return subject | self._body_plan.placeholders
+
+    def _check_values(self, values: Mapping) -> None:
+        missing = self.placeholders - values.keys()
+        if missing:
+            raise KeyError(f"Missing values for template {self.id}: {', '.join(sorted(missing))}")
+
     def render(self, **kwargs) -> tuple[Optional[str], str]:
         """Render template with provided variables."""
-        subject = self.subject_template.format(**kwargs) if self.subject_template else None
-        body = self.body_template.format(**kwargs)
+        self._check_values(kwargs)
+        subject = self._subject_plan.render(kwargs) if self._subject_plan else None
+        body = self._body_plan.render(kwargs)
         return subject, body
 
+    def render_many(
+        self,
+        rows: Iterable[Mapping],
+        defaults: Optional[Mapping] = None,
+    ) -> list[tuple[Optional[str], str]]:
+        """
+        Render the template for many recipients at once.
+
+        Args:
+            rows: Per-recipient values (e.g. customer_name, tax_year)
+            defaults: Values shared by every row; row values take precedence
+
+        Returns:
+            (subject, body) per row, in input order
+        """
+        rows = [{**defaults, **row} for row in rows] if defaults else list(rows)
+        for row in rows:
+            self._check_values(row)
+
+        bodies = self._body_plan.render_many(rows)
+        subjects = self._subject_plan.render_many(rows) if self._subject_plan else [None] * len(rows)
+        return list(zip(subjects, bodies))
+
 
 class CommunicationMessage(BaseModel):
     """A communication message to be sent."""
@@ -128,3 +228,14 @@ Gordon Ulen CPA Team""",
         comm_type=CommunicationType.EMAIL,
     ),
 }
+
+
+def _validate_default_templates() -> None:
+    """Fail at import if a default template needs a value the agent never supplies."""
+    for template in DEFAULT_TEMPLATES.values():
+        unknown = template.placeholders - TEMPLATE_PLACEHOLDERS
+        if unknown:
+            raise ValueError(f"Template {template.id} uses unknown placeholders: {', '.join(sorted(unknown))}")
+
+
+_validate_default_templates()
@@ -1,6 +1,8 @@
+import asyncio
 import httpx
 from typing import Any, Optional
 from .config import settings
+from .tracing import inject_headers, span
 
 
 class APIClient:
@@ -28,46 +30,107 @@ class APIClient:
             await self._client.aclose()
             self._client = None
 
-    async def get(self, endpoint: str, params: Optional[dict] = None) -> dict:
+    async def _request(self, method: str, endpoint: str, route: Optional[str] = None, **kwargs) -> httpx.Response:
+        """
+        Send a request, traced as "api <method> <route>".
+
+        `route` is the endpoint's template (e.g. "/api/returns/{id}") so span
+        names don't carry record IDs; it defaults to `endpoint` for fixed paths.
+        """
         client = await self._get_client()
-        response = await client.get(endpoint, params=params)
-        response.raise_for_status()
+        route = route or endpoint
+        attributes = {"http.method": method, "http.route": route, "http.url": f"{self.base_url}{endpoint}"}
+        with span(f"api {method} {route}", attributes) as current:
+            response = await client.request(method, endpoint, headers=inject_headers({}), **kwargs)
+            current.set_attribute("http.status_code", response.status_code)
+            response.raise_for_status()
+            return response
+
+    async def get(self, endpoint: str, params: Optional[dict] = None, route: Optional[str] = None) -> dict:
+        response = await self._request("GET", endpoint, route, params=params)
         return response.json()
 
-    async def post(self, endpoint: str, data: Optional[dict] = None) -> dict:
-        client = await self._get_client()
-        response = await client.post(endpoint, json=data)
-        response.raise_for_status()
+    async def post(self, endpoint: str, data: Optional[dict] = None, route: Optional[str] = None) -> dict:
+        response = await self._request("POST", endpoint, route, json=data)
         return response.json()
 
-    async def patch(self, endpoint: str, data: Optional[dict] = None) -> dict:
-        client = await self._get_client()
-        response = await client.patch(endpoint, json=data)
-        response.raise_for_status()
+    async def patch(self, endpoint: str, data: Optional[dict] = None, route: Optional[str] = None) -> dict:
+        response = await self._request("PATCH", endpoint, route, json=data)
         return response.json()
 
-    async def delete(self, endpoint: str) -> None:
-        client = await self._get_client()
-        response = await client.delete(endpoint)
-        response.raise_for_status()
+    async def delete(self, endpoint: str, route: Optional[str] = None) -> None:
+        await self._request("DELETE", endpoint, route)
+
+    async def list_all(
+        self,
+        endpoint: str,
+        params: Optional[dict] = None,
+        page_size: int = 100,
+        fields: Optional[list[str]] = None,
+    ) -> list:
+        """Fetch every page of a paginated list endpoint; `fields` is accepted for FirestoreReader parity and ignored."""
+        items: list = []
+        page = 1
+        while True:
+            result = await self.get(endpoint, params={**(params or {}), "page": page, "limit": page_size})
+            items.extend(result.get("data", []))
+            if not result.get("meta", {}).get("hasMore"):
+                return items
+            page += 1
+
+    async def get_many(
+        self,
+        endpoint: str,
+        ids: list[str],
+        fields: Optional[list[str]] = None,
+        concurrency: int = 10,
+    ) -> dict[str, dict]:
+        """
+        Records for `ids` by ID, one GET each with at most `concurrency` in flight.
+
+        Same interface as FirestoreReader.get_many: missing IDs are omitted and
+        `fields` is ignored. Records that fail to load are omitted too.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        unique_ids = list(dict.fromkeys(ids))
+        endpoint = endpoint.rstrip("/")
+
+        async def fetch(record_id: str) -> Optional[dict]:
+            async with semaphore:
+                try:
+                    return await self.get(f"{endpoint}/{record_id}", route=f"{endpoint}/{{id}}")
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code != 404:
+                        print(f"[API] Failed to fetch {endpoint}/{record_id}: {e}")
+                    return None
+                except httpx.HTTPError as e:
+                    print(f"[API] Failed to fetch {endpoint}/{record_id}: {e}")
+                    return None
+
+        records = await asyncio.gather(*(fetch(record_id) for record_id in unique_ids))
+        return {record_id: record for record_id, record in zip(unique_ids, records) if record}
 
     # Document-specific methods
     async def get_document(self, doc_id: str) -> dict:
-        return await self.get(f"/api/documents/{doc_id}")
+        return await self.get(f"/api/documents/{doc_id}", route="/api/documents/{id}")
 
     async def update_document(self, doc_id: str, data: dict) -> dict:
-        return await self.patch(f"/api/documents/{doc_id}", data)
+        return await self.patch(f"/api/documents/{doc_id}", data, route="/api/documents/{id}")
 
     # Customer methods
     async def get_customer(self, customer_id: str) -> dict:
-        return await self.get(f"/api/customers/{customer_id}")
+        return await self.get(f"/api/customers/{customer_id}", route="/api/customers/{id}")
 
     # Return methods
     async def get_return(self, return_id: str) -> dict:
-        return await self.get(f"/api/returns/{return_id}")
+        return await self.get(f"/api/returns/{return_id}", route="/api/returns/{id}")
 
     async def update_return_status(self, return_id: str, status: str, notes: str = "") -> dict:
-        return await self.patch(f"/api/returns/{return_id}/status", {"status": status, "notes": notes})
+        return await self.patch(
+            f"/api/returns/{return_id}/status",
+            {"status": status, "notes": notes},
+            route="/api/returns/{id}/status",
+        )
 
     # Communication methods
     async def send_communication(
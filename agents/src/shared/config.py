@@ -21,19 +21,104 @@ class Settings(BaseSettings):
     ocr_model: str = "claude-3-5-sonnet-20241022"  # Vision capable
     communication_model: str = "gpt-4o"
     status_model: str = "claude-3-5-haiku-20241022"  # Fast and cheap
+    # Cheaper models used once most of an LLM budget is spent
+    ocr_fallback_model: str = "claude-3-haiku-20240307"
+    communication_fallback_model: str = "gpt-4o-mini"
+
+    # LLM usage accounting and budgets (USD, per UTC day; 0 = unlimited)
+    llm_usage_path: str = "/tmp/taxhelper-agents-llm-usage.db"
+    llm_usage_retention_days: int = 90
+    llm_daily_budget_usd: float = 0.0
+    llm_customer_daily_budget_usd: float = 0.0
+    llm_degrade_fraction: float = 0.8  # Switch to fallback models at this fraction of a budget
+    ocr_deferred_interval_seconds: int = 300  # Retry budget-deferred documents this often
+
+    # LLM record/replay for offline benchmarks and regression tests
+    llm_replay_mode: str = "off"  # off | record | replay | auto (replay hits, record misses)
+    llm_cassette_dir: str = "/tmp/taxhelper-agents-cassettes"
+    llm_replay_latency_scale: float = 1.0  # 0 = replay instantly
 
     # Firebase Configuration
     firebase_project_id: str = ""
     google_application_credentials: str = ""
+    # Sweeps and campaigns read returns/documents/customers straight from Firestore
+    firestore_direct_reads: bool = False
+    firestore_emulator_host: str = ""  # e.g. localhost:8080 for the local emulator
+    firestore_batch_size: int = 300  # Documents per get_all call
 
     # Document processing
     max_file_size_mb: int = 10
+    ocr_inflight_budget_mb: int = 256  # Raw + base64 bytes of documents being processed at once
     supported_formats: list[str] = ["pdf", "jpg", "jpeg", "png"]
+    # Duplicate uploads: review | reuse (exact duplicates; near ones are reviewed) | flag | off
+    duplicate_detection: str = "review"
+    duplicate_index_path: str = "/tmp/taxhelper-agents-duplicates.db"
+    duplicate_max_distance: int = 10  # Max differing hash bits (of 64) per page
+
+    # Status tracking
+    deadline_index_ttl_seconds: int = 900  # Full reload interval for the deadline index
+    status_scan_ttl_seconds: int = 60  # How long a combined deadline/extension scan is shared
+    reevaluate_concurrency: int = 10  # Max in-flight status writes when applying a batch re-evaluation
+
+    # Scheduler - periodic sweeps, run by one leader worker
+    scheduler_enabled: bool = True
+    scheduler_lock_file: str = "/tmp/taxhelper-agents-scheduler.lock"
+    scheduler_jitter: float = 0.1  # +/- fraction of each interval
+    deadline_scan_interval_seconds: int = 3600
+    status_sweep_interval_seconds: int = 1800
+    scheduler_job_timeout_seconds: int = 600
+
+    # Notification outbox - status changes are queued locally, then delivered
+    outbox_path: str = "/tmp/taxhelper-agents-outbox.db"
+    outbox_max_attempts: int = 5
+    outbox_batch_size: int = 20
+    outbox_concurrency: int = 5
+    outbox_drain_interval_seconds: int = 5
+
+    # Tracing (OpenTelemetry) - spans go to a JSON-lines file and/or an OTLP/HTTP collector
+    tracing_enabled: bool = False
+    trace_file: str = ""
+    otlp_endpoint: str = ""  # e.g. http://localhost:4318/v1/traces
+
+    # Memory instrumentation (tracemalloc adds overhead, so it is opt-in)
+    memory_tracing_enabled: bool = False
+    memory_trace_frames: int = 10
+    memory_sample_rate: float = 0.1  # Fraction of requests running alone whose peak allocation is recorded
+
+    # Debug endpoints (profiling etc.) - disabled unless a token is set
+    debug_token: str = ""
+    profile_max_seconds: int = 60
+
+    # CPU-bound steps (base64, response parsing, batch rules) run off the event loop
+    cpu_executor: str = "thread"  # thread | process | none (inline)
+    cpu_workers: int = 0  # 0 = one per CPU
+    loop_lag_interval_seconds: float = 0.5
 
     # Communication settings
     email_sender: str = "noreply@gordonullencpa.com"
     sms_sender: str = ""
 
+    # Delivery scheduler - per-channel rate caps, coalescing and SMS quiet hours
+    delivery_scheduler_enabled: bool = True
+    email_rate_per_minute: float = 120
+    sms_rate_per_minute: float = 60
+    call_rate_per_minute: float = 10
+    delivery_coalesce_seconds: float = 30  # Hold messages this long to merge updates per customer
+    sms_quiet_hours_start: int = 21  # Local hour SMS stops
+    sms_quiet_hours_end: int = 8  # Local hour SMS resumes
+    office_timezone: str = "America/New_York"
+
+    # Repeat notifications for the same customer/return/status are suppressed in this window
+    notification_dedup_window_seconds: int = 3600
+
+    # Cached AI message drafts for statuses without a template
+    ai_message_cache_ttl_seconds: int = 86400
+    ai_message_cache_size: int = 256
+
+    # Bulk notification campaigns
+    campaign_concurrency: int = 10  # Max in-flight backend requests per campaign
+    campaign_store_path: str = "/tmp/taxhelper-agents-campaigns.db"
+
     class Config:
         env_file = str(ENV_FILE)
         env_file_encoding = "utf-8"
@@ -45,3 +130,8 @@ def get_settings() -> Settings:
 
 
 settings = get_settings()
+
+# The Firestore client only reads the emulator host from the environment, so
+# export it once here, when the process starts, rather than per client
+if settings.firestore_emulator_host:
+    os.environ.setdefault("FIRESTORE_EMULATOR_HOST", settings.firestore_emulator_host)
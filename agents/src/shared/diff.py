@@ -0,0 +1,33 @@
+from typing import Any
+
+
+def compact(value: Any) -> Any:
+    """Drop None entries from dicts, recursively (list items are kept)."""
+    if isinstance(value, dict):
+        return {key: compact(item) for key, item in value.items() if item is not None}
+    if isinstance(value, list):
+        return [compact(item) for item in value]
+    return value
+
+
+def patch_diff(current: dict, desired: dict) -> dict:
+    """
+    Minimal PATCH body taking a record from `current` to `desired`.
+
+    Top-level fields equal to the current value are dropped, and nulls inside
+    values are stripped. A changed map is sent whole, nulls stripped, because
+    the API replaces map fields rather than merging them. A top-level None is
+    only sent when it clears an existing value. An empty result means there
+    is nothing to write.
+    """
+    changes = {}
+    for key, value in desired.items():
+        existing = current.get(key)
+        if value is None:
+            if existing is not None:
+                changes[key] = None
+            continue
+        value = compact(value)
+        if value != compact(existing):
+            changes[key] = value
+    return changes
@@ -0,0 +1,47 @@
+"""
+Executor for CPU-bound steps (base64 encoding, response parsing, batch rule
+evaluation) so they don't stall the event loop.
+
+CPU_EXECUTOR picks the pool. "thread" is the default: hashing, Pillow and
+NumPy release the GIL, and nothing has to be pickled. "process" sidesteps the
+GIL for pure-Python work but copies every argument and result between
+processes, so only enable it where a measurement shows that pays off.
+"none" runs inline, as before. Functions sent to a process pool must be
+module-level and their arguments picklable.
+"""
+
+import asyncio
+import functools
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from .config import settings
+
+_executor: Optional[Executor] = None
+
+
+def get_executor() -> Optional[Executor]:
+    """The shared CPU executor, created on first use; None when running inline."""
+    global _executor
+    if _executor is None and settings.cpu_executor != "none":
+        workers = settings.cpu_workers or None
+        if settings.cpu_executor == "process":
+            _executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cpu")
+    return _executor
+
+
+async def run_cpu(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run `func(*args, **kwargs)` on the CPU executor and await the result."""
+    executor = get_executor()
+    if executor is None:
+        return func(*args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+def shutdown_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
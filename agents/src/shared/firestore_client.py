@@ -0,0 +1,168 @@
+"""
+Direct Firestore reads for sweeps and batch jobs.
+
+FirestoreReader reads returns, documents and customers straight from the
+collections the Node backend writes, skipping the REST hop and its per-page
+JSON round trips. Single-record reads and list_all match APIClient's read
+methods and records have the same shape ({...fields, "id"}). Bulk reads
+batch lookups with get_all, and `fields` projections fetch only what a sweep
+needs.
+
+Writes still go through the API, so its validation and side effects apply.
+Set FIRESTORE_EMULATOR_HOST (e.g. localhost:8080) to read from the local
+emulator with anonymous credentials; config exports it to the environment at
+startup, where the Firestore client looks for it.
+"""
+
+from datetime import datetime
+from typing import Any, Optional
+
+from .config import settings
+
+# API list endpoint -> Firestore collection
+COLLECTIONS = {
+    "/api/returns": "returns",
+    "/api/documents": "documents",
+    "/api/customers": "customers",
+}
+
+# Query parameters the API parses as integers before filtering
+INT_PARAMS = ("taxYear",)
+
+
+def _plain(value: Any) -> Any:
+    """Firestore values as the API would serialize them (timestamps become ISO strings)."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    return value
+
+
+def _record(snapshot) -> dict:
+    return {**_plain(snapshot.to_dict() or {}), "id": snapshot.id}
+
+
+class FirestoreReader:
+    """Read-only Firestore access with APIClient's read interface."""
+
+    def __init__(
+        self,
+        project_id: Optional[str] = None,
+        credentials_path: Optional[str] = None,
+        batch_size: Optional[int] = None,
+    ):
+        self.project_id = project_id or settings.firebase_project_id
+        self.credentials_path = credentials_path or settings.google_application_credentials
+        self.batch_size = batch_size or settings.firestore_batch_size
+        self._db = None
+
+    def _client(self):
+        if self._db is None:
+            if settings.firestore_emulator_host:
+                # FIRESTORE_EMULATOR_HOST is in the environment, so this uses anonymous credentials
+                from google.cloud.firestore import AsyncClient
+
+                self._db = AsyncClient(project=self.project_id)
+            else:
+                import firebase_admin
+                from firebase_admin import credentials, firestore_async
+
+                try:
+                    app = firebase_admin.get_app("agents")
+                except ValueError:
+                    credential = credentials.Certificate(self.credentials_path) if self.credentials_path else None
+                    app = firebase_admin.initialize_app(credential, {"projectId": self.project_id}, name="agents")
+                self._db = firestore_async.client(app)
+        return self._db
+
+    def _collection(self, endpoint: str):
+        try:
+            return self._client().collection(COLLECTIONS[endpoint.rstrip("/")])
+        except KeyError:
+            raise ValueError(f"No Firestore collection for {endpoint}")
+
+    async def _get_by_id(self, endpoint: str, record_id: str) -> dict:
+        snapshot = await self._collection(endpoint).document(record_id).get()
+        if not snapshot.exists:
+            raise LookupError(f"{endpoint}/{record_id} not found")
+        return _record(snapshot)
+
+    async def get(self, endpoint: str, params: Optional[dict] = None) -> dict:
+        """GET-style read of `/api/<collection>` (one unpaginated page) or `/api/<collection>/<id>`."""
+        collection_endpoint, _, record_id = endpoint.rstrip("/").rpartition("/")
+        if collection_endpoint in COLLECTIONS:
+            return await self._get_by_id(collection_endpoint, record_id)
+        items = await self.list_all(endpoint, params)
+        return {"data": items, "meta": {"total": len(items), "page": 1, "limit": len(items), "hasMore": False}}
+
+    async def list_all(
+        self,
+        endpoint: str,
+        params: Optional[dict] = None,
+        page_size: int = 100,
+        fields: Optional[list[str]] = None,
+    ) -> list:
+        """
+        Every record matching the API-style equality filters in `params`.
+
+        Args:
+            endpoint: API list endpoint, e.g. "/api/returns"
+            params: Equality filters, as passed to the API
+            page_size: Ignored; results are streamed in one query
+            fields: Only fetch these fields ("id" is always included)
+        """
+        from google.cloud.firestore_v1.base_query import FieldFilter
+
+        query = self._collection(endpoint)
+        for field, value in (params or {}).items():
+            if field in ("page", "limit") or value in (None, ""):
+                continue
+            if field in INT_PARAMS:
+                value = int(value)
+            query = query.where(filter=FieldFilter(field, "==", value))
+        if fields:
+            query = query.select(fields)
+        return [_record(snapshot) async for snapshot in query.stream()]
+
+    async def get_many(
+        self,
+        endpoint: str,
+        ids: list[str],
+        fields: Optional[list[str]] = None,
+    ) -> dict[str, dict]:
+        """
+        Records for `ids` by ID, fetched in batched get_all calls; missing IDs are omitted.
+
+        Args:
+            endpoint: API list endpoint, e.g. "/api/customers"
+            ids: Record IDs (duplicates are fetched once)
+            fields: Only fetch these fields ("id" is always included)
+        """
+        collection = self._collection(endpoint)
+        db = self._client()
+        unique_ids = list(dict.fromkeys(ids))
+        records: dict[str, dict] = {}
+        for start in range(0, len(unique_ids), self.batch_size):
+            refs = [collection.document(record_id) for record_id in unique_ids[start:start + self.batch_size]]
+            async for snapshot in db.get_all(refs, field_paths=fields):
+                if snapshot.exists:
+                    records[snapshot.id] = _record(snapshot)
+        return records
+
+    # Same helpers as APIClient
+    async def get_document(self, doc_id: str) -> dict:
+        return await self._get_by_id("/api/documents", doc_id)
+
+    async def get_customer(self, customer_id: str) -> dict:
+        return await self._get_by_id("/api/customers", customer_id)
+
+    async def get_return(self, return_id: str) -> dict:
+        return await self._get_by_id("/api/returns", return_id)
+
+
+def bulk_reader(api_client: Any) -> Any:
+    """A FirestoreReader when FIRESTORE_DIRECT_READS is set, otherwise `api_client` itself."""
+    return FirestoreReader() if settings.firestore_direct_reads else api_client
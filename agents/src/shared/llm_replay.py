@@ -0,0 +1,161 @@
+"""
+Record/replay for LLM calls, so the agents can be benchmarked and
+regression-tested offline.
+
+With LLM_REPLAY_MODE=record every response is written to a cassette file in
+LLM_CASSETTE_DIR, keyed by a fingerprint of the model, its bound arguments
+(tools, tool choice) and the request messages. With "replay" responses come
+from the cassettes and a miss is an error; "auto" replays hits and records
+misses. Replayed calls sleep for the recorded latency times
+LLM_REPLAY_LATENCY_SCALE (0 = instant), streamed chunks keeping their
+recorded spacing.
+
+Replayed responses carry `replayed: True` in their response_metadata, and
+the usage ledger doesn't charge them, so a replay run neither spends the
+real budget nor trips the fallback model (whose requests were never
+recorded).
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import time
+from typing import Any, AsyncIterator, Optional
+
+from langchain_core.messages import message_to_dict, messages_from_dict
+
+from .config import settings
+
+REPLAY_MODES = ("off", "record", "replay", "auto")
+
+
+def _replayed(message_dict: dict) -> Any:
+    """A recorded message, marked as replayed."""
+    message = messages_from_dict([message_dict])[0]
+    message.response_metadata = {**message.response_metadata, "replayed": True}
+    return message
+
+
+class CassetteMiss(Exception):
+    """Raised in replay mode when no recording matches a request."""
+
+
+class ReplayChatModel:
+    """
+    Wraps a LangChain chat model's ainvoke/astream with cassette recording and replay.
+
+    Only the methods the agents use are wrapped; anything else is delegated
+    to the wrapped client.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        model_name: str,
+        mode: str,
+        cassette_dir: str,
+        latency_scale: float = 1.0,
+    ):
+        if mode not in REPLAY_MODES:
+            raise ValueError(f"Unknown LLM replay mode '{mode}', expected one of {REPLAY_MODES}")
+        self.client = client
+        self.model_name = model_name
+        self.mode = mode
+        self.cassette_dir = cassette_dir
+        self.latency_scale = latency_scale
+        os.makedirs(cassette_dir, exist_ok=True)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
+
+    def fingerprint(self, messages: list, kind: str) -> str:
+        """Stable key for a request: model, bound arguments (e.g. tools) and messages."""
+        payload = {
+            "kind": kind,
+            "model": self.model_name,
+            # RunnableBinding (bind_tools) keeps its extra arguments in .kwargs
+            "bound": getattr(self.client, "kwargs", {}),
+            "messages": [message_to_dict(message) for message in messages],
+        }
+        encoded = json.dumps(payload, sort_keys=True, default=str).encode()
+        return hashlib.sha256(encoded).hexdigest()
+
+    def _path(self, fingerprint: str) -> str:
+        return os.path.join(self.cassette_dir, f"{fingerprint}.json")
+
+    def _load(self, fingerprint: str) -> Optional[dict]:
+        if self.mode == "record":
+            return None
+        try:
+            with open(self._path(fingerprint)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            if self.mode == "replay":
+                raise CassetteMiss(f"No cassette for {self.model_name} request {fingerprint[:12]}")
+            return None
+
+    def _save(self, fingerprint: str, cassette: dict) -> None:
+        # Write-then-rename so concurrent workers never see a partial cassette
+        fd, tmp_path = tempfile.mkstemp(dir=self.cassette_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(cassette, f)
+        os.replace(tmp_path, self._path(fingerprint))
+
+    async def _sleep_until(self, started: float, offset_seconds: float) -> None:
+        delay = started + offset_seconds * self.latency_scale - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def ainvoke(self, messages: list, **kwargs: Any) -> Any:
+        fingerprint = self.fingerprint(messages, "invoke")
+        cassette = self._load(fingerprint)
+        if cassette is not None:
+            started = time.monotonic()
+            await self._sleep_until(started, cassette["latency_seconds"])
+            return _replayed(cassette["response"])
+
+        started = time.monotonic()
+        response = await self.client.ainvoke(messages, **kwargs)
+        self._save(fingerprint, {
+            "model": self.model_name,
+            "latency_seconds": time.monotonic() - started,
+            "response": message_to_dict(response),
+        })
+        return response
+
+    async def astream(self, messages: list, **kwargs: Any) -> AsyncIterator[Any]:
+        fingerprint = self.fingerprint(messages, "stream")
+        cassette = self._load(fingerprint)
+        if cassette is not None:
+            started = time.monotonic()
+            for index, (offset, chunk) in enumerate(cassette["chunks"]):
+                await self._sleep_until(started, offset)
+                # Only the last chunk is marked, so summed chunks don't merge the flag
+                if index == len(cassette["chunks"]) - 1:
+                    yield _replayed(chunk)
+                else:
+                    yield messages_from_dict([chunk])[0]
+            return
+
+        started = time.monotonic()
+        chunks = []
+        async for chunk in self.client.astream(messages, **kwargs):
+            chunks.append([time.monotonic() - started, message_to_dict(chunk)])
+            yield chunk
+        # Only complete streams are recorded
+        self._save(fingerprint, {"model": self.model_name, "chunks": chunks})
+
+
+def replayable(client: Any, model_name: str) -> Any:
+    """Wrap `client` for recording/replay as configured; returned unchanged when replay is off."""
+    if settings.llm_replay_mode == "off":
+        return client
+    return ReplayChatModel(
+        client,
+        model_name,
+        settings.llm_replay_mode,
+        settings.llm_cassette_dir,
+        settings.llm_replay_latency_scale,
+    )
@@ -0,0 +1,349 @@
+"""
+LLM usage accounting and budgets.
+
+Every LLM call records input/output tokens, latency and an estimated cost in
+a local SQLite ledger shared by all workers, so spend can be reported per
+document, per customer and per day. Daily budgets (overall and per
+customer) switch callers to a cheaper fallback model once most of the budget
+is spent and refuse calls once it is gone; refused OCR work is parked in the
+ledger and retried when the budget allows.
+
+The ledger's methods block on SQLite, so async callers run them with
+asyncio.to_thread. The database is created on first use, not at import.
+"""
+
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+from typing import Any, List, Optional
+
+from .config import settings
+
+# USD per million tokens (input, output)
+MODEL_PRICES = {
+    "claude-3-5-sonnet-20241022": (3.00, 15.00),
+    "claude-3-5-haiku-20241022": (0.80, 4.00),
+    "claude-3-haiku-20240307": (0.25, 1.25),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+# Models already reported as missing from MODEL_PRICES
+_unpriced_models: set[str] = set()
+
+
+class BudgetExceeded(Exception):
+    """Raised instead of making an LLM call once the applicable daily budget is spent."""
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    """
+    Estimated USD cost of a call.
+
+    A model missing from MODEL_PRICES costs 0, so budgets don't see its
+    spend; the first call to each such model logs a warning.
+    """
+    if model not in MODEL_PRICES:
+        if model not in _unpriced_models:
+            _unpriced_models.add(model)
+            print(f"[LLM Usage] Warning: no price for model {model!r}; its calls count as $0 against budgets")
+        return 0.0
+    input_price, output_price = MODEL_PRICES[model]
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+def token_usage(response: Any) -> tuple[int, int]:
+    """(input_tokens, output_tokens) from a LangChain chat model response."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    # Older integrations only report provider-specific metadata
+    metadata = getattr(response, "response_metadata", None) or {}
+    usage = metadata.get("usage") or metadata.get("token_usage") or {}
+    return (
+        usage.get("input_tokens", usage.get("prompt_tokens", 0)),
+        usage.get("output_tokens", usage.get("completion_tokens", 0)),
+    )
+
+
+def _today() -> str:
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+def _totals(row: sqlite3.Row) -> dict:
+    return {
+        "calls": row["calls"],
+        "input_tokens": row["input_tokens"] or 0,
+        "output_tokens": row["output_tokens"] or 0,
+        "cost_usd": round(row["cost_usd"] or 0.0, 6),
+        "avg_latency_ms": round((row["latency_ms"] or 0.0) / max(row["calls"], 1), 1),
+    }
+
+
+_TOTALS_SQL = (
+    "COUNT(*) AS calls, SUM(input_tokens) AS input_tokens, SUM(output_tokens) AS output_tokens, "
+    "SUM(cost_usd) AS cost_usd, SUM(latency_ms) AS latency_ms"
+)
+
+
+class UsageLedger:
+    """SQLite ledger of LLM calls with daily budget checks (UTC days)."""
+
+    def __init__(
+        self,
+        path: str,
+        daily_budget_usd: float = 0.0,
+        customer_daily_budget_usd: float = 0.0,
+        degrade_fraction: float = 0.8,
+        retention_days: int = 90,
+    ):
+        self.path = path
+        self.daily_budget_usd = daily_budget_usd
+        self.customer_daily_budget_usd = customer_daily_budget_usd
+        self.degrade_fraction = degrade_fraction
+        self.retention_days = retention_days
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _create_schema(self, conn: sqlite3.Connection) -> None:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_usage (
+                at REAL NOT NULL,
+                day TEXT NOT NULL,
+                operation TEXT NOT NULL,
+                model TEXT NOT NULL,
+                input_tokens INTEGER NOT NULL,
+                output_tokens INTEGER NOT NULL,
+                latency_ms REAL NOT NULL,
+                cost_usd REAL NOT NULL,
+                document_id TEXT,
+                customer_id TEXT
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS llm_usage_day ON llm_usage (day, customer_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS llm_usage_document ON llm_usage (document_id)")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_deferred (
+                operation TEXT NOT NULL,
+                item_id TEXT NOT NULL,
+                deferred_at REAL NOT NULL,
+                customer_id TEXT,
+                PRIMARY KEY (operation, item_id)
+            )
+            """
+        )
+        # Ledgers created before per-customer retries lack the customer_id column
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(llm_deferred)")}
+        if "customer_id" not in columns:
+            conn.execute("ALTER TABLE llm_deferred ADD COLUMN customer_id TEXT")
+        cutoff = (datetime.now(timezone.utc).date() - timedelta(days=self.retention_days)).isoformat()
+        conn.execute("DELETE FROM llm_usage WHERE day < ?", (cutoff,))
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    self._create_schema(conn)
+                    self._schema_ready = True
+        return conn
+
+    def record(
+        self,
+        operation: str,
+        model: str,
+        response: Any,
+        latency_seconds: float,
+        document_id: Optional[str] = None,
+        customer_id: Optional[str] = None,
+    ) -> float:
+        """
+        Record one LLM call from its response; returns the estimated cost.
+
+        Responses replayed from a cassette (see llm_replay) cost nothing and
+        aren't recorded.
+        """
+        if (getattr(response, "response_metadata", None) or {}).get("replayed"):
+            return 0.0
+        input_tokens, output_tokens = token_usage(response)
+        cost = estimate_cost(model, input_tokens, output_tokens)
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO llm_usage (at, day, operation, model, input_tokens, output_tokens, latency_ms, "
+                "cost_usd, document_id, customer_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    time.time(),
+                    _today(),
+                    operation,
+                    model,
+                    input_tokens,
+                    output_tokens,
+                    latency_seconds * 1000,
+                    cost,
+                    document_id,
+                    customer_id,
+                ),
+            )
+        return cost
+
+    def spend(self, day: Optional[str] = None, customer_id: Optional[str] = None) -> float:
+        """USD spent on a day (default today), overall or for one customer."""
+        with closing(self._connect()) as conn:
+            return self._spend(conn, day, customer_id)
+
+    @staticmethod
+    def _spend(conn: sqlite3.Connection, day: Optional[str] = None, customer_id: Optional[str] = None) -> float:
+        query = "SELECT COALESCE(SUM(cost_usd), 0) FROM llm_usage WHERE day = ?"
+        params: list = [day or _today()]
+        if customer_id:
+            query += " AND customer_id = ?"
+            params.append(customer_id)
+        return conn.execute(query, params).fetchone()[0]
+
+    def _budget_checks(self, customer_id: Optional[str]) -> List[tuple[str, float, float]]:
+        """(label, spent, budget) for each configured budget."""
+        checks = []
+        if self.daily_budget_usd > 0:
+            checks.append(("daily", self.spend(), self.daily_budget_usd))
+        if self.customer_daily_budget_usd > 0 and customer_id:
+            checks.append(
+                (f"customer {customer_id} daily", self.spend(customer_id=customer_id), self.customer_daily_budget_usd)
+            )
+        return checks
+
+    def budget_available(self, customer_id: Optional[str] = None) -> bool:
+        return all(spent < budget for _, spent, budget in self._budget_checks(customer_id))
+
+    def choose_model(self, primary: str, fallback: str, customer_id: Optional[str] = None) -> str:
+        """
+        Model to use for the next call.
+
+        Returns `fallback` once any budget is `degrade_fraction` spent and
+        raises BudgetExceeded once any budget is fully spent.
+        """
+        model = primary
+        for label, spent, budget in self._budget_checks(customer_id):
+            if spent >= budget:
+                raise BudgetExceeded(f"LLM {label} budget of ${budget:.2f} exhausted (${spent:.2f} spent)")
+            if spent >= budget * self.degrade_fraction:
+                model = fallback
+        return model
+
+    def defer(self, operation: str, item_id: str, customer_id: Optional[str] = None) -> None:
+        """Park work refused for budget reasons until the budget allows it."""
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO llm_deferred (operation, item_id, deferred_at, customer_id) VALUES (?, ?, ?, ?)",
+                (operation, item_id, time.time(), customer_id),
+            )
+
+    def take_deferred(self, operation: str, limit: int) -> List[str]:
+        """
+        Remove and return up to `limit` of the oldest parked items for `operation`
+        whose budgets allow a retry.
+
+        Nothing is taken while the overall budget is spent; items of customers
+        whose own budget is spent stay parked.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            taken: List[str] = []
+            if self.daily_budget_usd <= 0 or self._spend(conn) < self.daily_budget_usd:
+                rows = conn.execute(
+                    "SELECT item_id, customer_id FROM llm_deferred WHERE operation = ? ORDER BY deferred_at",
+                    (operation,),
+                ).fetchall()
+                customer_ok: dict = {}
+                for row in rows:
+                    customer_id = row["customer_id"]
+                    if customer_id not in customer_ok:
+                        customer_ok[customer_id] = (
+                            self.customer_daily_budget_usd <= 0
+                            or not customer_id
+                            or self._spend(conn, customer_id=customer_id) < self.customer_daily_budget_usd
+                        )
+                    if customer_ok[customer_id]:
+                        taken.append(row["item_id"])
+                        if len(taken) >= limit:
+                            break
+                conn.executemany(
+                    "DELETE FROM llm_deferred WHERE operation = ? AND item_id = ?",
+                    [(operation, item_id) for item_id in taken],
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return taken
+
+    def report(self, day: Optional[str] = None, days: int = 7, limit: int = 20) -> dict:
+        """Usage for one day broken down by operation, model, customer and document, plus daily totals."""
+        day = day or _today()
+        with closing(self._connect()) as conn:
+            totals = conn.execute(f"SELECT {_TOTALS_SQL} FROM llm_usage WHERE day = ?", (day,)).fetchone()
+            grouped = {}
+            for column in ("operation", "model"):
+                rows = conn.execute(
+                    f"SELECT {column} AS name, {_TOTALS_SQL} FROM llm_usage WHERE day = ? GROUP BY {column}",
+                    (day,),
+                ).fetchall()
+                grouped[column] = {row["name"]: _totals(row) for row in rows}
+            top = {}
+            for column in ("customer_id", "document_id"):
+                rows = conn.execute(
+                    f"SELECT {column} AS name, {_TOTALS_SQL} FROM llm_usage WHERE day = ? AND {column} IS NOT NULL "
+                    f"GROUP BY {column} ORDER BY cost_usd DESC LIMIT ?",
+                    (day, limit),
+                ).fetchall()
+                top[column] = [{column: row["name"], **_totals(row)} for row in rows]
+            ocr = conn.execute(
+                "SELECT COUNT(DISTINCT document_id) AS documents, SUM(cost_usd) AS cost_usd "
+                "FROM llm_usage WHERE day = ? AND operation = 'ocr_extract'",
+                (day,),
+            ).fetchone()
+            daily = conn.execute(
+                f"SELECT day, {_TOTALS_SQL} FROM llm_usage GROUP BY day ORDER BY day DESC LIMIT ?",
+                (days,),
+            ).fetchall()
+            deferred = conn.execute(
+                "SELECT operation, COUNT(*) AS n FROM llm_deferred GROUP BY operation"
+            ).fetchall()
+
+        return {
+            "day": day,
+            "budget": {
+                "daily_budget_usd": self.daily_budget_usd,
+                "customer_daily_budget_usd": self.customer_daily_budget_usd,
+                "degrade_fraction": self.degrade_fraction,
+                "spent_usd": round(totals["cost_usd"] or 0.0, 6),
+            },
+            "totals": _totals(totals),
+            "by_operation": grouped["operation"],
+            "by_model": grouped["model"],
+            "top_customers": top["customer_id"],
+            "top_documents": top["document_id"],
+            # The number to hold against the "<$50 per 1,000 pages" target
+            "ocr_cost_per_1000_documents_usd": round(1000 * (ocr["cost_usd"] or 0.0) / ocr["documents"], 2)
+            if ocr["documents"]
+            else None,
+            "daily": [{"day": row["day"], **_totals(row)} for row in daily],
+            "deferred": {row["operation"]: row["n"] for row in deferred},
+        }
+
+
+usage = UsageLedger(
+    settings.llm_usage_path,
+    daily_budget_usd=settings.llm_daily_budget_usd,
+    customer_daily_budget_usd=settings.llm_customer_daily_budget_usd,
+    degrade_fraction=settings.llm_degrade_fraction,
+    retention_days=settings.llm_usage_retention_days,
+)
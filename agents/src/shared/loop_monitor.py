@@ -0,0 +1,53 @@
+import asyncio
+from typing import Optional
+
+
+class LoopLagMonitor:
+    """
+    Measures event-loop lag: how late a periodic sleep wakes up.
+
+    A responsive loop wakes within a millisecond or so of the requested
+    interval; anything blocking the loop (CPU-bound work, sync I/O) shows up
+    directly as lag.
+    """
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.last_ms = 0.0
+        self.max_ms = 0.0
+        self._total_ms = 0.0
+        self._samples = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="loop-lag-monitor")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag_ms = max(loop.time() - started - self.interval, 0.0) * 1000
+            self.last_ms = lag_ms
+            self.max_ms = max(self.max_ms, lag_ms)
+            self._total_ms += lag_ms
+            self._samples += 1
+
+    def stats(self) -> dict:
+        return {
+            "last_ms": round(self.last_ms, 2),
+            "max_ms": round(self.max_ms, 2),
+            "avg_ms": round(self._total_ms / max(self._samples, 1), 2),
+            "samples": self._samples,
+        }
+
+
+loop_lag = LoopLagMonitor()
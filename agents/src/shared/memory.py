@@ -0,0 +1,184 @@
+"""
+Memory instrumentation: process RSS gauges, tracemalloc allocation sites,
+per-request peaks and per-stage retained memory.
+
+tracemalloc only runs when MEMORY_TRACING_ENABLED is set, since it slows
+allocation-heavy code. RSS gauges are always available.
+"""
+
+import random
+import resource
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from .config import settings
+
+_PAGE_SIZE = resource.getpagesize()
+
+
+def rss_bytes() -> int:
+    """Current resident set size, from /proc where available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def peak_rss_bytes() -> int:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _top_stats(stats, limit: int) -> list[dict]:
+    return [
+        {
+            "site": str(stat.traceback[0]) if stat.traceback else "?",
+            "size_bytes": stat.size,
+            "count": stat.count,
+            **({"size_diff_bytes": stat.size_diff, "count_diff": stat.count_diff} if hasattr(stat, "size_diff") else {}),
+        }
+        for stat in stats[:limit]
+    ]
+
+
+class MemoryMonitor:
+    """Collects memory gauges, sampled per-request peaks and per-stage deltas."""
+
+    def __init__(self):
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._baseline_at: Optional[float] = None
+        # route -> {"samples", "max_peak_bytes", "last_peak_bytes"}
+        self.requests: dict[str, dict] = defaultdict(lambda: {"samples": 0, "max_peak_bytes": 0, "last_peak_bytes": 0})
+        # stage -> {"samples", "max_retained_bytes", "total_retained_bytes"}
+        self.stages: dict[str, dict] = defaultdict(lambda: {"samples": 0, "max_retained_bytes": 0, "total_retained_bytes": 0})
+        # Requests in flight and started so far, to keep only samples that ran alone
+        self._in_flight = 0
+        self._started = 0
+        self.overlapping_samples = 0
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self) -> None:
+        if settings.memory_tracing_enabled and not tracemalloc.is_tracing():
+            tracemalloc.start(settings.memory_trace_frames)
+
+    def gauges(self) -> dict:
+        gauges = {"rss_bytes": rss_bytes(), "peak_rss_bytes": peak_rss_bytes(), "tracing": self.tracing}
+        if self.tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            gauges["traced_bytes"] = current
+            gauges["traced_peak_bytes"] = peak
+        return gauges
+
+    @contextmanager
+    def track_request(self) -> Iterator[dict]:
+        """
+        Record the traced-memory peak above the starting level for a sampled request.
+
+        Yields a dict; set "route" on it to group the sample. The tracemalloc
+        peak is process-wide, so a request is only sampled when no other
+        request is in flight, and the sample is dropped (counted in
+        overlapping_samples) if another request starts before it ends.
+        Background work such as the scheduler and outbox drainer still counts
+        towards the peak.
+        """
+        sample: dict = {}
+        alone = self._in_flight == 0
+        self._in_flight += 1
+        self._started += 1
+        started = self._started
+        if not alone or not self.tracing or random.random() >= settings.memory_sample_rate:
+            try:
+                yield sample
+            finally:
+                self._in_flight -= 1
+            return
+
+        start, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        try:
+            yield sample
+        finally:
+            self._in_flight -= 1
+            _, peak = tracemalloc.get_traced_memory()
+            if self._started != started:
+                self.overlapping_samples += 1
+            else:
+                stats = self.requests[sample.get("route", "unknown")]
+                stats["samples"] += 1
+                stats["last_peak_bytes"] = peak - start
+                stats["max_peak_bytes"] = max(stats["max_peak_bytes"], peak - start)
+
+    @contextmanager
+    def track_stage(self, stage: str) -> Iterator[None]:
+        """Record how much traced memory a workflow stage leaves allocated when it returns."""
+        if not self.tracing:
+            yield
+            return
+
+        start, _ = tracemalloc.get_traced_memory()
+        try:
+            yield
+        finally:
+            retained = tracemalloc.get_traced_memory()[0] - start
+            stats = self.stages[stage]
+            stats["samples"] += 1
+            stats["total_retained_bytes"] += retained
+            stats["max_retained_bytes"] = max(stats["max_retained_bytes"], retained)
+
+    def top_sites(self, limit: int = 20) -> list[dict]:
+        if not self.tracing:
+            return []
+        return _top_stats(tracemalloc.take_snapshot().statistics("lineno"), limit)
+
+    def take_baseline(self) -> None:
+        """Store a snapshot for later diffs."""
+        self._baseline = tracemalloc.take_snapshot()
+        self._baseline_at = time.time()
+
+    def diff(self, limit: int = 20) -> Optional[dict]:
+        """Allocation sites that grew most since the baseline snapshot."""
+        if self._baseline is None:
+            return None
+        stats = tracemalloc.take_snapshot().compare_to(self._baseline, "lineno")
+        return {"baseline_at": self._baseline_at, "top": _top_stats(stats, limit)}
+
+    def report(self, limit: int = 20) -> dict:
+        return {
+            **self.gauges(),
+            "top_sites": self.top_sites(limit),
+            "requests": dict(self.requests),
+            "overlapping_samples": self.overlapping_samples,
+            "stages": {
+                stage: {**stats, "avg_retained_bytes": stats["total_retained_bytes"] // max(stats["samples"], 1)}
+                for stage, stats in self.stages.items()
+            },
+        }
+
+
+memory = MemoryMonitor()
+
+
+class MemoryMiddleware:
+    """ASGI middleware sampling per-request peak allocations, grouped by route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with memory.track_request() as sample:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                route = scope.get("route")
+                sample["route"] = f"{scope['method']} {getattr(route, 'path', scope['path'])}"
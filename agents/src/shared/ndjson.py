@@ -0,0 +1,95 @@
+import json
+import zlib
+from typing import AsyncIterator, Optional
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def _quality(header: str, value: str) -> Optional[float]:
+    """q-value given to `value` in an Accept-style header; None if it isn't listed."""
+    for item in header.split(","):
+        name, *params = [part.strip() for part in item.split(";")]
+        if name.lower() != value:
+            continue
+        for param in params:
+            key, _, q = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    return float(q)
+                except ValueError:
+                    return 0.0
+        return 1.0
+    return None
+
+
+def wants_ndjson(request: Request) -> bool:
+    """
+    Whether NDJSON ranks at least as high as plain JSON in the Accept header.
+
+    JSON takes the q of its most specific listed range (application/json,
+    then application/*, then */*). NDJSON must be listed by name, and wins ties.
+    """
+    accept = request.headers.get("accept", "")
+    ndjson = _quality(accept, NDJSON_MEDIA_TYPE)
+    if not ndjson:
+        return False
+    for media_range in ("application/json", "application/*", "*/*"):
+        json_quality = _quality(accept, media_range)
+        if json_quality is not None:
+            return ndjson >= json_quality
+    return True
+
+
+def _wants_gzip(request: Request) -> bool:
+    # "gzip;q=0" refuses gzip; otherwise a wildcard accepts it
+    header = request.headers.get("accept-encoding", "")
+    quality = _quality(header, "gzip")
+    if quality is None:
+        quality = _quality(header, "*")
+    return (quality or 0.0) > 0
+
+
+async def _lines(items: AsyncIterator[dict], batch_size: int) -> AsyncIterator[bytes]:
+    """
+    One JSON object per line, sent in batches of `batch_size` lines.
+
+    The status line has already gone out, so if `items` fails the stream
+    ends with an {"error": ...} line instead of just stopping short.
+    """
+    batch = []
+    try:
+        async for item in items:
+            batch.append(json.dumps(item))
+            if len(batch) >= batch_size:
+                yield ("\n".join(batch) + "\n").encode()
+                batch = []
+    except Exception as e:
+        print(f"[NDJSON] Stream failed after a partial response: {e}")
+        batch.append(json.dumps({"error": str(e)}))
+    if batch:
+        yield ("\n".join(batch) + "\n").encode()
+
+
+async def _gzipped(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    # Sync-flush each batch so the client can decode it as soon as it arrives
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    async for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def ndjson_response(request: Request, items: AsyncIterator[dict], batch_size: int = 100) -> StreamingResponse:
+    """
+    Stream `items` as newline-delimited JSON, gzip-compressed if the client accepts it.
+
+    Memory stays bounded by one batch however many items there are.
+    """
+    body = _lines(items, batch_size)
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Vary": "Accept, Accept-Encoding"}
+    if _wants_gzip(request):
+        body = _gzipped(body)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type=NDJSON_MEDIA_TYPE, headers=headers)
@@ -0,0 +1,286 @@
+import asyncio
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, List, Optional
+
+from .llm_usage import BudgetExceeded
+from .tracing import attached, current_traceparent
+
+# Set by OutboxDrainer while it delivers an entry; see handed_off()
+_handoff: ContextVar[Optional[Callable[[], None]]] = ContextVar("outbox_handoff", default=None)
+
+
+def handed_off() -> None:
+    """
+    Tell the drainer delivering the current notification that it is queued for sending.
+
+    The drainer then frees its concurrency slot and waits for the send result
+    in the background. A no-op outside a drainer delivery.
+    """
+    callback = _handoff.get()
+    if callback:
+        callback()
+
+
+class NotificationOutbox:
+    """
+    Local SQLite outbox for status-change notifications.
+
+    Status changes write a row here and return immediately; an OutboxDrainer
+    delivers rows later with retries. Rows survive a process restart, so a
+    notification is not lost if the worker dies mid-delivery.
+    """
+
+    def __init__(self, path: str, max_attempts: int = 5, base_backoff_seconds: float = 30.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.base_backoff_seconds = base_backoff_seconds
+        with closing(self._connect()) as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id TEXT PRIMARY KEY,
+                    customer_id TEXT NOT NULL,
+                    return_id TEXT,
+                    status TEXT NOT NULL,
+                    state TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_error TEXT,
+                    traceparent TEXT
+                )
+                """
+            )
+            # Outboxes created before tracing lack the traceparent column
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(outbox)")}
+            if "traceparent" not in columns:
+                conn.execute("ALTER TABLE outbox ADD COLUMN traceparent TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (state, next_attempt_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def enqueue(self, customer_id: str, status: str, return_id: Optional[str] = None) -> str:
+        """Record a notification to deliver; returns the outbox entry ID."""
+        entry_id = str(uuid.uuid4())
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO outbox (id, customer_id, return_id, status, next_attempt_at, created_at, traceparent) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (entry_id, customer_id, return_id, status, now, now, current_traceparent()),
+            )
+        return entry_id
+
+    def claim_batch(self, limit: int, lease_seconds: float = 300.0) -> List[dict]:
+        """
+        Claim up to `limit` due entries.
+
+        Claimed entries are pushed `lease_seconds` into the future, so a crashed
+        drainer's entries become due again instead of being lost.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT * FROM outbox WHERE state = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE outbox SET next_attempt_at = ?, attempts = attempts + 1 WHERE id = ?",
+                [(now + lease_seconds, row["id"]) for row in rows],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return [{**dict(row), "attempts": row["attempts"] + 1} for row in rows]
+
+    def renew_lease(self, entry_id: str, lease_seconds: float) -> None:
+        """Push a claimed entry's lease out again while its delivery is still in progress."""
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE outbox SET next_attempt_at = ? WHERE id = ? AND state = 'pending'",
+                (time.time() + lease_seconds, entry_id),
+            )
+
+    def mark_delivered(self, entry_id: str) -> None:
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM outbox WHERE id = ?", (entry_id,))
+
+    def mark_failed(self, entry: dict, error: str) -> None:
+        """Schedule a retry with exponential backoff, or park the entry once out of attempts."""
+        if entry["attempts"] >= self.max_attempts:
+            state, next_attempt_at = "dead", time.time()
+        else:
+            state = "pending"
+            next_attempt_at = time.time() + self.base_backoff_seconds * 2 ** (entry["attempts"] - 1)
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE outbox SET state = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (state, next_attempt_at, error[:500], entry["id"]),
+            )
+
+    def mark_deferred(self, entry: dict, error: str, delay_seconds: float) -> None:
+        """Retry after `delay_seconds` without using up an attempt (e.g. the LLM budget is spent)."""
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE outbox SET attempts = attempts - 1, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (time.time() + delay_seconds, error[:500], entry["id"]),
+            )
+
+    def counts(self) -> dict:
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT state, COUNT(*) AS n FROM outbox GROUP BY state").fetchall()
+        return {row["state"]: row["n"] for row in rows}
+
+
+class OutboxDrainer:
+    """
+    Delivers outbox entries in batches with bounded concurrency.
+
+    An entry is only removed once `deliver` reports the backend accepted the
+    message. Entries refused because the LLM budget is spent are retried
+    after `defer_seconds` without counting as a failed attempt. Outbox reads
+    and writes run in a thread, off the event loop.
+    Claims are transactional, so every worker can run a drainer.
+
+    Once `deliver` calls handed_off() (the message sits in the delivery
+    scheduler's queue), the entry stops holding a concurrency slot; its result
+    is recorded when the send completes, and its lease is renewed until then
+    so other workers don't claim it again.
+    """
+
+    def __init__(
+        self,
+        outbox: NotificationOutbox,
+        deliver: Callable[..., Awaitable[Any]],
+        batch_size: int = 20,
+        concurrency: int = 5,
+        defer_seconds: float = 600.0,
+        lease_seconds: float = 300.0,
+    ):
+        self.outbox = outbox
+        # Called as deliver(customer_id, status, return_id); falsy result means failure
+        self.deliver = deliver
+        self.batch_size = batch_size
+        self.defer_seconds = defer_seconds
+        self.lease_seconds = lease_seconds
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._task: Optional[asyncio.Task] = None
+        # Deliveries in flight, including those waiting on the delivery scheduler
+        self._deliveries: set[asyncio.Task] = set()
+
+    def start(self, interval_seconds: float) -> None:
+        """Drain every `interval_seconds` in the background."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(interval_seconds), name="outbox-drainer")
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """
+        Stop claiming entries and give in-flight deliveries `timeout` seconds to finish.
+
+        Deliveries still waiting after that are cancelled; their entries keep
+        their lease and are delivered again once it runs out.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._deliveries:
+            _, still_waiting = await asyncio.wait(set(self._deliveries), timeout=timeout)
+            for task in still_waiting:
+                task.cancel()
+            await asyncio.gather(*still_waiting, return_exceptions=True)
+
+    async def _run(self, interval_seconds: float) -> None:
+        while True:
+            try:
+                await self.drain_once()
+            except Exception as e:
+                print(f"[Outbox] Drain failed: {e}")
+            await asyncio.sleep(interval_seconds)
+
+    async def drain_once(self) -> dict:
+        """
+        Deliver every entry that is currently due.
+
+        Returns:
+            delivered/failed/deferred counts, plus `queued` for entries handed
+            to the delivery scheduler whose result is recorded later
+        """
+        counts = {"delivered": 0, "failed": 0, "deferred": 0, "queued": 0}
+        while True:
+            batch = await asyncio.to_thread(self.outbox.claim_batch, self.batch_size, self.lease_seconds)
+            if not batch:
+                break
+            for outcome in await asyncio.gather(*(self._deliver_entry(entry) for entry in batch)):
+                counts[outcome] += 1
+
+        if any(counts.values()):
+            print(
+                f"[Outbox] Delivered {counts['delivered']}, failed {counts['failed']}, "
+                f"deferred {counts['deferred']}, queued {counts['queued']}"
+            )
+        return counts
+
+    async def _deliver_entry(self, entry: dict) -> str:
+        # Hold a slot until the message is sent or queued with the delivery scheduler
+        async with self._semaphore:
+            queued = asyncio.Event()
+            delivery = asyncio.create_task(self._complete(entry, queued))
+            self._deliveries.add(delivery)
+            delivery.add_done_callback(self._deliveries.discard)
+            handoff = asyncio.create_task(queued.wait())
+            try:
+                await asyncio.wait({delivery, handoff}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                handoff.cancel()
+        if delivery.done():
+            return delivery.result()
+        return "queued"
+
+    async def _complete(self, entry: dict, queued: asyncio.Event) -> str:
+        """Run `deliver` for one entry and record the result in the outbox."""
+        renewer = asyncio.create_task(self._renew_while_queued(entry, queued))
+        # Only this task's context sees the callback
+        _handoff.set(queued.set)
+        try:
+            # Deliver under the trace of the request that queued the notification
+            with attached(entry.get("traceparent")):
+                ok = await self.deliver(entry["customer_id"], entry["status"], entry["return_id"])
+            error = None if ok else "Delivery reported failure"
+        except BudgetExceeded as e:
+            await asyncio.to_thread(self.outbox.mark_deferred, entry, str(e), self.defer_seconds)
+            return "deferred"
+        except Exception as e:
+            error = str(e)
+        finally:
+            renewer.cancel()
+
+        if error:
+            if queued.is_set():
+                print(f"[Outbox] Queued notification {entry['id']} failed: {error}")
+            await asyncio.to_thread(self.outbox.mark_failed, entry, error)
+            return "failed"
+        await asyncio.to_thread(self.outbox.mark_delivered, entry["id"])
+        return "delivered"
+
+    async def _renew_while_queued(self, entry: dict, queued: asyncio.Event) -> None:
+        await queued.wait()
+        while True:
+            await asyncio.sleep(self.lease_seconds / 2)
+            try:
+                await asyncio.to_thread(self.outbox.renew_lease, entry["id"], self.lease_seconds)
+            except Exception as e:
+                print(f"[Outbox] Could not renew lease on {entry['id']}: {e}")
@@ -0,0 +1,107 @@
+import asyncio
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", code.co_filename)
+    return f"{module}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """
+    Low-overhead sampling profiler for the event loop's thread and, optionally, worker threads.
+
+    A background thread snapshots stacks every `interval` seconds via
+    sys._current_frames(); the profiled code is never instrumented. Each
+    stack is rooted at its thread group ("event-loop", or the name prefix of
+    the worker threads it came from) so loop time and pool time stay apart.
+    Output is the collapsed-stack format flame graph tools read
+    ("outer;inner;leaf count" per line).
+    """
+
+    def __init__(
+        self,
+        thread_id: Optional[int] = None,
+        interval: float = 0.005,
+        worker_prefixes: Tuple[str, ...] = (),
+    ):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        # Threads whose names start with one of these are sampled too (e.g. "cpu" for run_cpu's pool)
+        self.worker_prefixes = worker_prefixes
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _targets(self) -> Dict[int, str]:
+        """Thread ID -> group label for every thread to sample right now."""
+        targets = {self.thread_id: "event-loop"}
+        if self.worker_prefixes:
+            # Pools start and retire threads, so look them up on every sample
+            for thread in threading.enumerate():
+                for prefix in self.worker_prefixes:
+                    if thread.name.startswith(prefix) and thread.ident is not None:
+                        targets[thread.ident] = prefix
+                        break
+        return targets
+
+    def _sample(self) -> None:
+        while not self._stop.is_set():
+            frames = sys._current_frames()
+            for thread_id, group in self._targets().items():
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(group)
+                self.samples[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+_profile_lock = asyncio.Lock()
+
+
+def profile_in_progress() -> bool:
+    return _profile_lock.locked()
+
+
+async def profile_event_loop(
+    seconds: float,
+    interval: float = 0.005,
+    worker_prefixes: Tuple[str, ...] = ("cpu", "asyncio"),
+) -> str:
+    """
+    Sample the running event loop's thread, plus worker threads, for `seconds`; returns collapsed stacks.
+
+    The defaults cover run_cpu's thread pool ("cpu") and asyncio.to_thread's
+    ("asyncio"). Idle pool threads show up waiting in their work queue.
+    Work in a process pool runs in other processes and is not sampled.
+    """
+    async with _profile_lock:
+        profiler = SamplingProfiler(threading.get_ident(), interval, worker_prefixes)
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            await asyncio.to_thread(profiler.stop)
+        return profiler.collapsed()
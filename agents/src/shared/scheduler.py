@@ -0,0 +1,108 @@
+import asyncio
+import fcntl
+import os
+import random
+from typing import Any, Awaitable, Callable, Optional
+
+from .tracing import span
+
+
+class LeaderLock:
+    """
+    Single-leader election across uvicorn workers using an advisory file lock.
+
+    Whichever worker holds the exclusive lock on `path` is the leader. The OS
+    releases the lock if that process dies, so another worker takes over on
+    its next attempt.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+
+class Scheduler:
+    """
+    In-process async scheduler for periodic sweeps.
+
+    Each job runs on its own interval with random jitter and a timeout. Jobs
+    only run in the worker holding the leader lock; the other workers keep
+    their loops alive so they can take over, but just serve requests.
+    """
+
+    def __init__(self, lock: LeaderLock, jitter: float = 0.1):
+        self.lock = lock
+        self.jitter = jitter
+        self._jobs: list[dict] = []
+        self._tasks: list[asyncio.Task] = []
+
+    def add_job(
+        self,
+        name: str,
+        func: Callable[[], Awaitable[Any]],
+        interval_seconds: float,
+        timeout_seconds: float,
+    ) -> None:
+        """Register a coroutine function to run every `interval_seconds`."""
+        self._jobs.append({
+            "name": name,
+            "func": func,
+            "interval": interval_seconds,
+            "timeout": timeout_seconds,
+        })
+
+    def start(self) -> None:
+        for job in self._jobs:
+            self._tasks.append(asyncio.create_task(self._run_job(job), name=f"scheduler:{job['name']}"))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.lock.release()
+
+    def _next_delay(self, interval: float) -> float:
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    async def _run_job(self, job: dict) -> None:
+        while True:
+            await asyncio.sleep(self._next_delay(job["interval"]))
+
+            if not self.lock.try_acquire():
+                continue
+
+            try:
+                with span(f"job {job['name']}"):
+                    await asyncio.wait_for(job["func"](), timeout=job["timeout"])
+            except asyncio.TimeoutError:
+                print(f"[Scheduler] Job {job['name']} timed out after {job['timeout']}s")
+            except Exception as e:
+                print(f"[Scheduler] Job {job['name']} failed: {e}")
@@ -0,0 +1,107 @@
+import contextvars
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
+from functools import wraps
+from typing import Any, Awaitable, Callable, Optional
+
+from .memory import memory
+from .tracing import span, state_attributes
+
+_current_run: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("workflow_run", default=None)
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+class LatencyRecorder:
+    """
+    Per-workflow node timings and critical-path reports.
+
+    Wrap graph nodes with `node()` and each invocation with `run()`. Nodes
+    that fan out time their concurrent pieces with `branch()`; the slowest
+    branch of a node is the one on the critical path.
+    """
+
+    def __init__(self, window: int = 200):
+        self._runs: dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+
+    @asynccontextmanager
+    async def run(self, workflow: str):
+        run = {"workflow": workflow, "nodes": [], "branches": defaultdict(dict)}
+        token = _current_run.set(run)
+        start = time.perf_counter()
+        try:
+            yield run
+        finally:
+            run["total_ms"] = (time.perf_counter() - start) * 1000
+            _current_run.reset(token)
+            self._runs[workflow].append(run)
+
+    def node(self, name: str, func: Callable[[Any], Awaitable[Any]]) -> Callable[[Any], Awaitable[Any]]:
+        """Wrap a graph node so its duration is recorded in the current run, inside a trace span."""
+
+        @wraps(func)
+        async def timed(state):
+            start = time.perf_counter()
+            run = _current_run.get()
+            stage = f"{run['workflow']}.{name}" if run else name
+            try:
+                with span(f"node {name}", state_attributes(state)), memory.track_stage(stage):
+                    return await func(state)
+            finally:
+                if run is not None:
+                    run["nodes"].append((name, (time.perf_counter() - start) * 1000))
+
+        return timed
+
+    @contextmanager
+    def branch(self, node: str, name: str):
+        """Time one concurrent branch inside a node."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            run = _current_run.get()
+            if run is not None:
+                run["branches"][node][name] = (time.perf_counter() - start) * 1000
+
+    def report(self) -> dict:
+        """Latency summary per workflow, including the critical path of the latest run."""
+        report = {}
+        for workflow, runs in self._runs.items():
+            if not runs:
+                continue
+            totals = [r["total_ms"] for r in runs]
+            node_times: dict[str, list[float]] = defaultdict(list)
+            for r in runs:
+                for name, ms in r["nodes"]:
+                    node_times[name].append(ms)
+
+            latest = runs[-1]
+            critical_path = []
+            for name, ms in latest["nodes"]:
+                step = {"node": name, "ms": round(ms, 1)}
+                branches = latest["branches"].get(name)
+                if branches:
+                    slowest = max(branches, key=branches.get)
+                    step["branch"] = slowest
+                    step["branches"] = {b: round(t, 1) for b, t in branches.items()}
+                critical_path.append(step)
+
+            report[workflow] = {
+                "runs": len(runs),
+                "total_ms": {
+                    "avg": round(sum(totals) / len(totals), 1),
+                    "p50": round(_percentile(totals, 0.5), 1),
+                    "p95": round(_percentile(totals, 0.95), 1),
+                },
+                "nodes_avg_ms": {n: round(sum(t) / len(t), 1) for n, t in node_times.items()},
+                "critical_path": critical_path,
+            }
+        return report
+
+
+latency = LatencyRecorder()
@@ -0,0 +1,134 @@
+"""
+OpenTelemetry tracing for the agents service.
+
+Spans cover FastAPI requests, LangGraph nodes, APIClient requests and LLM
+calls. Tracing is off unless TRACING_ENABLED is set; spans are then written
+as JSON lines to TRACE_FILE and/or sent to an OTLP/HTTP collector at
+OTLP_ENDPOINT. Without a configured provider the OpenTelemetry API is a no-op.
+"""
+
+from contextlib import contextmanager
+from typing import Any, Iterator, Mapping, Optional
+
+from opentelemetry import context as otel_context
+from opentelemetry import propagate, trace
+from opentelemetry.trace import Span, Status, StatusCode
+
+from .config import settings
+
+tracer = trace.get_tracer("taxhelper-agents")
+
+# State keys recorded as span attributes on graph nodes
+ID_ATTRIBUTES = ("document_id", "tax_return_id", "return_id", "customer_id")
+
+
+def setup_tracing() -> None:
+    """Install the tracer provider and exporters from settings."""
+    if not settings.tracing_enabled:
+        return
+
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+    provider = TracerProvider(resource=Resource.create({"service.name": "taxhelper-agents"}))
+
+    if settings.trace_file:
+        trace_file = open(settings.trace_file, "a", buffering=1)
+        provider.add_span_processor(
+            BatchSpanProcessor(
+                ConsoleSpanExporter(
+                    out=trace_file,
+                    formatter=lambda span: span.to_json(indent=None) + "\n",
+                )
+            )
+        )
+
+    if settings.otlp_endpoint:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=settings.otlp_endpoint)))
+
+    trace.set_tracer_provider(provider)
+
+
+@contextmanager
+def span(name: str, attributes: Optional[Mapping[str, Any]] = None) -> Iterator[Span]:
+    """Start a child span of the current context; exceptions are recorded on the span."""
+    with tracer.start_as_current_span(name) as current:
+        for key, value in (attributes or {}).items():
+            if value is not None and value != "":
+                current.set_attribute(key, value if isinstance(value, (str, bool, int, float)) else str(value))
+        yield current
+
+
+def state_attributes(state: Mapping) -> dict:
+    """ID attributes for a workflow state dict."""
+    return {key: state.get(key) for key in ID_ATTRIBUTES if key in state}
+
+
+def inject_headers(headers: dict) -> dict:
+    """Add W3C traceparent headers for the current span."""
+    propagate.inject(headers)
+    return headers
+
+
+def current_traceparent() -> Optional[str]:
+    """Serialized current context, for work that runs outside this task (e.g. the outbox)."""
+    carrier: dict = {}
+    propagate.inject(carrier)
+    return carrier.get("traceparent")
+
+
+@contextmanager
+def attached(traceparent: Optional[str]) -> Iterator[None]:
+    """Make a stored traceparent the parent of spans started inside the block."""
+    if not traceparent:
+        yield
+        return
+    token = otel_context.attach(propagate.extract({"traceparent": traceparent}))
+    try:
+        yield
+    finally:
+        otel_context.detach(token)
+
+
+class TracingMiddleware:
+    """ASGI middleware opening a server span per HTTP request, including its background tasks."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        parent = propagate.extract(headers)
+        # Renamed to the route template once routing has matched; the concrete path only goes
+        # in http.target, so unmatched paths (404s, scanners) don't each make a new span name
+        with tracer.start_as_current_span(scope["method"], context=parent, kind=trace.SpanKind.SERVER) as current:
+            current.set_attribute("http.method", scope["method"])
+            current.set_attribute("http.target", scope["path"])
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    _name_from_route(current, scope)
+                    current.set_attribute("http.status_code", message["status"])
+                    if message["status"] >= 500:
+                        current.set_status(Status(StatusCode.ERROR))
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                _name_from_route(current, scope)
+
+
+def _name_from_route(current: trace.Span, scope: dict) -> None:
+    """Name a server span after the matched route's path template (e.g. /documents/{document_id})."""
+    route = getattr(scope.get("route"), "path", None)
+    if route:
+        current.update_name(f"{scope['method']} {route}")
+        current.set_attribute("http.route", route)
@@ -1,18 +1,28 @@
 import asyncio
-from datetime import datetime, timedelta
-from typing import Optional, List
+import time
+from datetime import datetime, timezone
+from typing import AsyncIterator, Optional, List
 
 from langgraph.graph import StateGraph, END
 from typing_extensions import TypedDict
 
 from ..shared.api_client import APIClient
+from ..shared.config import settings
+from ..shared.executor import run_cpu
+from ..shared.firestore_client import bulk_reader
+from ..shared.outbox import NotificationOutbox, OutboxDrainer
+from ..shared.timing import latency
 from ..communication import CommunicationAgent
+from .batch import recommend_transitions
+from .deadline_index import DeadlineIndex, SECONDS_PER_DAY
 
 
 class TrackerState(TypedDict):
     """State for the status tracker workflow."""
 
     tax_return_id: str
+    customer_id: Optional[str]
+    tax_year: Optional[int]
     return_data: Optional[dict]
     documents: List[dict]
     current_status: str
@@ -43,28 +53,65 @@ class StatusTrackerAgent:
         "990": [],
     }
 
+    # Statuses the tracker may advance on its own; later stages need a preparer
+    AUTO_ADVANCE_STATUSES = ["intake", "documents_pending"]
+
+    # Statuses each document event can advance; a new upload isn't processed yet,
+    # so it can only move a return out of intake
+    DOCUMENT_EVENT_STATUSES = {
+        "document_created": ["intake"],
+        "document_processed": AUTO_ADVANCE_STATUSES,
+    }
+
+    # Early-stage statuses that need an extension when the due date is close
+    EXTENSION_CANDIDATE_STATUSES = [
+        "intake",
+        "documents_pending",
+        "documents_complete",
+        "in_preparation",
+    ]
+
+    # Fields sweeps and batch rules read; list reads fetch only these (plus "id")
+    RETURN_SCAN_FIELDS = ["customerId", "taxYear", "returnType", "status", "dueDate", "extensionFiled"]
+    DOCUMENT_RULE_FIELDS = ["customerId", "taxYear", "type", "status"]
+
     def __init__(
         self,
         api_client: Optional[APIClient] = None,
         communication_agent: Optional[CommunicationAgent] = None,
+        outbox: Optional[NotificationOutbox] = None,
     ):
         self.api_client = api_client or APIClient()
+        # Bulk reads for sweeps go straight to Firestore when enabled
+        self.reader = bulk_reader(self.api_client)
         self.communication_agent = communication_agent or CommunicationAgent(self.api_client)
+        self.outbox = outbox or NotificationOutbox(
+            settings.outbox_path,
+            max_attempts=settings.outbox_max_attempts,
+        )
+        self.outbox_drainer = OutboxDrainer(
+            self.outbox,
+            self.communication_agent.notify_status_change,
+            batch_size=settings.outbox_batch_size,
+            concurrency=settings.outbox_concurrency,
+        )
+        self.deadline_index = DeadlineIndex(ttl_seconds=settings.deadline_index_ttl_seconds)
+        self._scan_lock = asyncio.Lock()
+        self._scan_snapshot: Optional[dict] = None
+        self._scan_snapshot_at = 0.0
         self.workflow = self._build_workflow()
 
     def _build_workflow(self) -> StateGraph:
         """Build the status tracking workflow."""
         workflow = StateGraph(TrackerState)
 
-        workflow.add_node("fetch_return", self._fetch_return)
-        workflow.add_node("fetch_documents", self._fetch_documents)
-        workflow.add_node("analyze_status", self._analyze_status)
-        workflow.add_node("update_status", self._update_status)
-        workflow.add_node("send_notification", self._send_notification)
+        workflow.add_node("fetch_data", latency.node("fetch_data", self._fetch_data))
+        workflow.add_node("analyze_status", latency.node("analyze_status", self._analyze_status))
+        workflow.add_node("update_status", latency.node("update_status", self._update_status))
+        workflow.add_node("send_notification", latency.node("send_notification", self._send_notification))
 
-        workflow.set_entry_point("fetch_return")
-        workflow.add_edge("fetch_return", "fetch_documents")
-        workflow.add_edge("fetch_documents", "analyze_status")
+        workflow.set_entry_point("fetch_data")
+        workflow.add_edge("fetch_data", "analyze_status")
         workflow.add_conditional_edges(
             "analyze_status",
             lambda s: "update_status" if s.get("recommended_status") else END,
@@ -77,18 +124,30 @@ class StatusTrackerAgent:
 
         return workflow.compile()
 
-    async def check_return(self, return_id: str) -> dict:
+    async def check_return(
+        self,
+        return_id: str,
+        customer_id: Optional[str] = None,
+        tax_year: Optional[int] = None,
+    ) -> dict:
         """
         Check and update status for a tax return.
 
         Args:
             return_id: Tax return ID to check
+            customer_id: Return's customer, if already known
+            tax_year: Return's tax year, if already known
+
+        When both customer_id and tax_year are given, documents are fetched
+        concurrently with the return instead of after it.
 
         Returns:
             Dict with status check results
         """
         initial_state: TrackerState = {
             "tax_return_id": return_id,
+            "customer_id": customer_id,
+            "tax_year": tax_year,
             "return_data": None,
             "documents": [],
             "current_status": "",
@@ -98,7 +157,8 @@ class StatusTrackerAgent:
             "error": None,
         }
 
-        final_state = await self.workflow.ainvoke(initial_state)
+        async with latency.run("status_tracker"):
+            final_state = await self.workflow.ainvoke(initial_state)
 
         return {
             "return_id": return_id,
@@ -109,124 +169,281 @@ class StatusTrackerAgent:
             "error": final_state.get("error"),
         }
 
-    async def check_deadlines(self) -> List[dict]:
-        """Check all returns for upcoming deadlines."""
-        alerts = []
+    async def handle_document_event(
+        self,
+        customer_id: str,
+        tax_year: Optional[int] = None,
+        document_id: Optional[str] = None,
+        event: str = "document_processed",
+    ) -> List[dict]:
+        """
+        Re-evaluate the returns affected by a document being created or processed.
 
-        try:
-            # Get all active returns
-            result = await self.api_client.get("/api/returns", params={"limit": 100})
-            returns = result.get("data", [])
+        Only returns for the document's customer (and tax year, when known) are
+        checked, so status stays current without sweeping every return.
 
-            today = datetime.now()
-            warning_threshold = today + timedelta(days=14)
+        Args:
+            customer_id: Customer the document belongs to
+            tax_year: Tax year of the document, if known
+            document_id: Document that triggered the event (for logging)
+            event: "document_created" or "document_processed"
 
-            for tax_return in returns:
-                if tax_return.get("status") in ["completed", "filed", "picked_up"]:
-                    continue
-
-                due_date_str = tax_return.get("dueDate")
-                if not due_date_str:
-                    continue
-
-                due_date = datetime.fromisoformat(due_date_str.replace("Z", "+00:00"))
-
-                if due_date < today:
-                    alerts.append({
-                        "return_id": tax_return["id"],
-                        "customer_id": tax_return["customerId"],
-                        "alert_type": "overdue",
-                        "due_date": due_date_str,
-                        "days_overdue": (today - due_date).days,
-                    })
-                elif due_date < warning_threshold:
-                    alerts.append({
-                        "return_id": tax_return["id"],
-                        "customer_id": tax_return["customerId"],
-                        "alert_type": "upcoming",
-                        "due_date": due_date_str,
-                        "days_until_due": (due_date - today).days,
-                    })
+        Returns:
+            List of status check results, one per affected return
+        """
+        params = {"customerId": customer_id}
+        if tax_year:
+            params["taxYear"] = tax_year
 
+        try:
+            result = await self.reader.get("/api/returns", params=params)
+            returns = result.get("data", [])
+            for tax_return in returns:
+                self.deadline_index.upsert(tax_return)
         except Exception as e:
-            print(f"Error checking deadlines: {e}")
+            print(f"[StatusTracker] Failed to fetch returns for document event {document_id}: {e}")
+            return []
+
+        # Only early-stage returns the event can move are re-checked
+        statuses = self.DOCUMENT_EVENT_STATUSES[event]
+        affected = [r for r in returns if r.get("status") in statuses]
+        if not affected:
+            return []
+
+        results = await asyncio.gather(*(
+            self.check_return(r["id"], customer_id=customer_id, tax_year=r.get("taxYear"))
+            for r in affected
+        ))
+        print(f"[StatusTracker] Document event {document_id}: re-evaluated {len(results)} return(s) for {customer_id}")
+        return list(results)
+
+    async def _ensure_deadline_index(self) -> DeadlineIndex:
+        """Reload the deadline index from the API once it has gone stale."""
+        if self.deadline_index.is_stale:
+            returns = await self.reader.list_all("/api/returns", fields=self.RETURN_SCAN_FIELDS)
+            self.deadline_index.load(returns)
+        return self.deadline_index
+
+    async def scan_returns(self, force: bool = False) -> dict:
+        """
+        Scan the return set once for deadline alerts, extension candidates and status counts.
 
-        return alerts
+        The result is a short-lived snapshot shared by every caller (the morning
+        dashboard hits deadlines and extensions back to back), so the return
+        set is read at most once per `status_scan_ttl_seconds`.
 
-    async def identify_extensions_needed(self) -> List[dict]:
-        """Identify returns that need extensions filed."""
-        extensions_needed = []
+        Args:
+            force: Reload the deadline index and rescan regardless of age
+        """
+        if not force and self._scan_snapshot_fresh():
+            return self._scan_snapshot
+
+        async with self._scan_lock:
+            # Another caller may have refreshed the snapshot while we waited
+            if not force and self._scan_snapshot_fresh():
+                return self._scan_snapshot
+            if force:
+                self.deadline_index.loaded_at = None
+
+            index = await self._ensure_deadline_index()
+            now = time.time()
+
+            alerts = []
+            extensions_needed = []
+
+            for due_ts, tax_return in index.due_before(14, now):
+                alerts.append(self._deadline_alert(due_ts, tax_return, now))
+                extension = self._extension_candidate(due_ts, tax_return, now)
+                if extension:
+                    extensions_needed.append(extension)
+
+            self._scan_snapshot = {
+                "alerts": alerts,
+                "extensions_needed": extensions_needed,
+                "status_counts": dict(index.status_counts()),
+                "generated_at": datetime.now(timezone.utc).isoformat(),
+            }
+            self._scan_snapshot_at = time.monotonic()
+            return self._scan_snapshot
+
+    async def iter_scan(self, kind: str) -> AsyncIterator[dict]:
+        """
+        Yield deadline alerts ("alerts") or extension candidates ("extensions_needed") one at a time.
 
-        try:
-            result = await self.api_client.get("/api/returns", params={"limit": 100})
-            returns = result.get("data", [])
+        Serves a fresh scan snapshot when there is one; otherwise walks the
+        deadline index directly, so large books stream without building lists.
+        """
+        if self._scan_snapshot_fresh():
+            for item in self._scan_snapshot[kind]:
+                yield item
+            return
+
+        index = await self._ensure_deadline_index()
+        now = time.time()
+        for due_ts, tax_return in index.due_before(14, now):
+            if kind == "alerts":
+                yield self._deadline_alert(due_ts, tax_return, now)
+            else:
+                extension = self._extension_candidate(due_ts, tax_return, now)
+                if extension:
+                    yield extension
+
+    @staticmethod
+    def _deadline_alert(due_ts: float, tax_return: dict, now: float) -> dict:
+        if due_ts < now:
+            return {
+                "return_id": tax_return["id"],
+                "customer_id": tax_return["customerId"],
+                "alert_type": "overdue",
+                "due_date": tax_return["dueDate"],
+                "days_overdue": int((now - due_ts) // SECONDS_PER_DAY),
+            }
+        return {
+            "return_id": tax_return["id"],
+            "customer_id": tax_return["customerId"],
+            "alert_type": "upcoming",
+            "due_date": tax_return["dueDate"],
+            "days_until_due": int((due_ts - now) // SECONDS_PER_DAY),
+        }
 
-            today = datetime.now()
-            # Extension cutoff - 7 days before due date
-            extension_threshold = timedelta(days=7)
+    def _extension_candidate(self, due_ts: float, tax_return: dict, now: float) -> Optional[dict]:
+        """Extension entry for a return due within 7 days that is still early-stage, else None."""
+        if (
+            due_ts >= now + 7 * SECONDS_PER_DAY
+            or tax_return.get("extensionFiled")
+            or tax_return.get("status") not in self.EXTENSION_CANDIDATE_STATUSES
+        ):
+            return None
+        return {
+            "return_id": tax_return["id"],
+            "customer_id": tax_return["customerId"],
+            "tax_year": tax_return["taxYear"],
+            "return_type": tax_return["returnType"],
+            "due_date": tax_return["dueDate"],
+            "current_status": tax_return["status"],
+        }
+
+    def _scan_snapshot_fresh(self) -> bool:
+        return (
+            self._scan_snapshot is not None
+            and time.monotonic() - self._scan_snapshot_at < settings.status_scan_ttl_seconds
+        )
 
+    async def sweep_statuses(self) -> List[dict]:
+        """Re-check every return the tracker could advance automatically."""
+        results = []
+        for status in self.AUTO_ADVANCE_STATUSES:
+            returns = await self.reader.list_all(
+                "/api/returns",
+                params={"status": status},
+                fields=self.RETURN_SCAN_FIELDS,
+            )
             for tax_return in returns:
-                # Skip if already filed or extension already filed
-                if tax_return.get("status") in ["completed", "filed", "picked_up", "extension_filed"]:
-                    continue
-                if tax_return.get("extensionFiled"):
-                    continue
-
-                due_date_str = tax_return.get("dueDate")
-                if not due_date_str:
-                    continue
-
-                due_date = datetime.fromisoformat(due_date_str.replace("Z", "+00:00"))
-
-                # If due date is within threshold and status is early stage
-                if due_date - today < extension_threshold:
-                    if tax_return.get("status") in [
-                        "intake",
-                        "documents_pending",
-                        "documents_complete",
-                        "in_preparation",
-                    ]:
-                        extensions_needed.append({
-                            "return_id": tax_return["id"],
-                            "customer_id": tax_return["customerId"],
-                            "tax_year": tax_return["taxYear"],
-                            "return_type": tax_return["returnType"],
-                            "due_date": due_date_str,
-                            "current_status": tax_return["status"],
-                        })
+                results.append(await self.check_return(
+                    tax_return["id"],
+                    customer_id=tax_return.get("customerId"),
+                    tax_year=tax_return.get("taxYear"),
+                ))
 
-        except Exception as e:
-            print(f"Error identifying extensions: {e}")
+        changed = sum(1 for r in results if r.get("status_changed"))
+        print(f"[StatusTracker] Sweep checked {len(results)} return(s), {changed} status change(s)")
+        return results
 
-        return extensions_needed
+    async def reevaluate_all(self, apply: bool = False) -> List[dict]:
+        """
+        Re-evaluate every return against the status rules in one batch.
 
-    async def _fetch_return(self, state: TrackerState) -> TrackerState:
-        """Fetch tax return data."""
+        Intended for full re-evaluation after rule changes; loads all returns
+        and documents once and computes transitions with the vectorized engine.
+
+        Args:
+            apply: Write the recommended statuses back (no notifications are sent),
+                at most `reevaluate_concurrency` at a time
+
+        Returns:
+            List of recommended transitions; when applying, each has "applied"
+            and, if its write failed, "error"
+        """
+        returns, documents = await asyncio.gather(
+            self.reader.list_all("/api/returns", fields=self.RETURN_SCAN_FIELDS),
+            self.reader.list_all("/api/documents", fields=self.DOCUMENT_RULE_FIELDS),
+        )
+        transitions = await run_cpu(recommend_transitions, returns, documents, self.REQUIRED_DOCUMENTS)
+
+        if apply:
+            semaphore = asyncio.Semaphore(settings.reevaluate_concurrency)
+
+            async def apply_transition(transition: dict) -> None:
+                async with semaphore:
+                    try:
+                        await self.api_client.update_return_status(
+                            transition["return_id"],
+                            transition["recommended_status"],
+                            notes="Status updated automatically by status tracker batch re-evaluation",
+                        )
+                    except Exception as e:
+                        print(f"[StatusTracker] Re-evaluation failed for {transition['return_id']}: {e}")
+                        transition.update(applied=False, error=str(e))
+                        return
+                self.deadline_index.update_status(transition["return_id"], transition["recommended_status"])
+                transition["applied"] = True
+
+            await asyncio.gather(*(apply_transition(transition) for transition in transitions))
+            self._scan_snapshot = None
+            failed = sum(1 for transition in transitions if not transition["applied"])
+            print(f"[StatusTracker] Applied {len(transitions) - failed} transition(s), {failed} failed")
+
+        print(f"[StatusTracker] Batch re-evaluation: {len(transitions)} transition(s) across {len(returns)} return(s)")
+        return transitions
+
+    async def check_deadlines(self) -> List[dict]:
+        """Check all returns for upcoming deadlines."""
         try:
-            tax_return = await self.api_client.get_return(state["tax_return_id"])
-            state["return_data"] = tax_return
-            state["current_status"] = tax_return.get("status", "")
+            return (await self.scan_returns())["alerts"]
         except Exception as e:
-            state["error"] = f"Failed to fetch return: {e}"
-        return state
+            print(f"Error checking deadlines: {e}")
+            return []
 
-    async def _fetch_documents(self, state: TrackerState) -> TrackerState:
-        """Fetch documents for the return."""
+    async def identify_extensions_needed(self) -> List[dict]:
+        """Identify returns that need extensions filed."""
         try:
-            if not state["return_data"]:
-                return state
+            return (await self.scan_returns())["extensions_needed"]
+        except Exception as e:
+            print(f"Error identifying extensions: {e}")
+            return []
 
-            customer_id = state["return_data"].get("customerId")
-            tax_year = state["return_data"].get("taxYear")
+    async def _fetch_data(self, state: TrackerState) -> TrackerState:
+        """Fetch the return and its documents, concurrently when the document query is already known."""
 
-            result = await self.api_client.get(
-                "/api/documents",
-                params={"customerId": customer_id, "taxYear": tax_year},
-            )
-            state["documents"] = result.get("data", [])
+        async def fetch_return():
+            with latency.branch("fetch_data", "return"):
+                return await self.api_client.get_return(state["tax_return_id"])
+
+        async def fetch_documents(customer_id, tax_year):
+            with latency.branch("fetch_data", "documents"):
+                result = await self.api_client.get(
+                    "/api/documents",
+                    params={"customerId": customer_id, "taxYear": tax_year},
+                )
+                return result.get("data", [])
 
+        try:
+            if state["customer_id"] and state["tax_year"]:
+                tax_return, documents = await asyncio.gather(
+                    fetch_return(),
+                    fetch_documents(state["customer_id"], state["tax_year"]),
+                )
+            else:
+                # Document query depends on the return
+                tax_return = await fetch_return()
+                documents = await fetch_documents(tax_return.get("customerId"), tax_return.get("taxYear"))
+
+            state["return_data"] = tax_return
+            state["current_status"] = tax_return.get("status", "")
+            state["documents"] = documents
+            self.deadline_index.upsert(tax_return)
         except Exception as e:
-            state["error"] = f"Failed to fetch documents: {e}"
+            state["error"] = f"Failed to fetch return data: {e}"
         return state
 
     async def _analyze_status(self, state: TrackerState) -> TrackerState:
@@ -274,6 +491,8 @@ class StatusTrackerAgent:
                 notes="Status updated automatically by status tracker agent",
             )
             state["status_changed"] = True
+            self.deadline_index.update_status(state["tax_return_id"], state["recommended_status"])
+            self._scan_snapshot = None
             print(f"[StatusTracker] Updated {state['tax_return_id']}: {state['current_status']} -> {state['recommended_status']}")
 
         except Exception as e:
@@ -281,15 +500,17 @@ class StatusTrackerAgent:
         return state
 
     async def _send_notification(self, state: TrackerState) -> TrackerState:
-        """Send notification about status change."""
+        """Record a notification about the status change in the outbox."""
         if not state["status_changed"] or not state["return_data"]:
             return state
 
         try:
+            # Delivery (and any LLM call) happens later in the outbox drainer
             customer_id = state["return_data"].get("customerId")
-            await self.communication_agent.notify_status_change(
+            await asyncio.to_thread(
+                self.outbox.enqueue,
                 customer_id=customer_id,
-                new_status=state["recommended_status"],
+                status=state["recommended_status"],
                 return_id=state["tax_return_id"],
             )
             state["notification_sent"] = True
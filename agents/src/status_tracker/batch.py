@@ -0,0 +1,122 @@
+"""
+Vectorized status rules for full re-evaluation runs.
+
+Applies the same rules as `StatusTrackerAgent._analyze_status`, but to every
+return at once: returns and documents are loaded into NumPy columns, document
+types become bits in a uint64 mask, and each return type's required documents
+become a mask to compare against.
+"""
+
+from typing import List, Mapping, Sequence
+
+import numpy as np
+
+PROCESSED_STATUSES = ("processed", "verified")
+
+# Status codes used in the status column
+_OTHER, _INTAKE, _DOCUMENTS_PENDING = 0, 1, 2
+
+
+def _type_bits(documents: Sequence[dict], required_documents: Mapping[str, Sequence[str]]) -> dict:
+    """
+    Assign one bit per document type seen in the documents or the rules.
+
+    A missing type gets a bit of its own, as `_analyze_status` counts an
+    untyped processed document towards "has any documents".
+    """
+    types = {t for reqs in required_documents.values() for t in reqs}
+    types.update(doc.get("type") for doc in documents)
+    if len(types) > 64:
+        raise ValueError(f"Too many document types for a 64-bit mask: {len(types)}")
+    ordered = sorted(types, key=lambda t: (t is not None, str(t)))
+    return {t: np.uint64(1) << np.uint64(i) for i, t in enumerate(ordered)}
+
+
+def recommend_transitions(
+    returns: Sequence[dict],
+    documents: Sequence[dict],
+    required_documents: Mapping[str, Sequence[str]],
+) -> List[dict]:
+    """
+    Compute recommended status transitions for every return in one pass.
+
+    Args:
+        returns: Tax return records (id, customerId, taxYear, status, returnType)
+        documents: Document records (customerId, taxYear, type, status)
+        required_documents: Required document types per return type
+
+    Returns:
+        One dict per return whose status should change, with return_id,
+        current_status and recommended_status
+    """
+    if not returns:
+        return []
+
+    bits = _type_bits(documents, required_documents)
+
+    # Group documents by (customerId, taxYear), the key a return looks them up by
+    groups: dict = {}
+    doc_group = np.fromiter(
+        (groups.setdefault((d.get("customerId"), d.get("taxYear")), len(groups)) for d in documents),
+        dtype=np.int64,
+        count=len(documents),
+    )
+    doc_bits = np.fromiter(
+        (
+            bits[d.get("type")] if d.get("status") in PROCESSED_STATUSES else 0
+            for d in documents
+        ),
+        dtype=np.uint64,
+        count=len(documents),
+    )
+
+    # Returns without any documents point at an extra, empty group
+    empty_group = len(groups)
+    return_group = np.fromiter(
+        (groups.get((r.get("customerId"), r.get("taxYear")), empty_group) for r in returns),
+        dtype=np.int64,
+        count=len(returns),
+    )
+
+    group_count = np.zeros(empty_group + 1, dtype=np.int64)
+    group_mask = np.zeros(empty_group + 1, dtype=np.uint64)
+    np.add.at(group_count, doc_group, 1)
+    np.bitwise_or.at(group_mask, doc_group, doc_bits)
+
+    required_masks = {
+        return_type: np.uint64(sum(int(bits[t]) for t in reqs))
+        for return_type, reqs in required_documents.items()
+    }
+    required = np.fromiter(
+        (required_masks.get(r.get("returnType", "1040"), 0) for r in returns),
+        dtype=np.uint64,
+        count=len(returns),
+    )
+    status_codes = {"intake": _INTAKE, "documents_pending": _DOCUMENTS_PENDING}
+    status = np.fromiter(
+        (status_codes.get(r.get("status"), _OTHER) for r in returns),
+        dtype=np.int8,
+        count=len(returns),
+    )
+
+    count = group_count[return_group]
+    mask = group_mask[return_group]
+    has_required = np.where(required != 0, (mask & required) == required, mask != 0)
+
+    to_pending = (status == _INTAKE) & (count > 0)
+    to_complete = (status == _DOCUMENTS_PENDING) & has_required
+
+    transitions = []
+    for i in np.flatnonzero(to_pending):
+        transitions.append({
+            "return_id": returns[i]["id"],
+            "current_status": "intake",
+            "recommended_status": "documents_pending",
+        })
+    for i in np.flatnonzero(to_complete):
+        transitions.append({
+            "return_id": returns[i]["id"],
+            "current_status": "documents_pending",
+            "recommended_status": "documents_complete",
+        })
+    return transitions
@@ -0,0 +1,114 @@
+"""
+Benchmark the vectorized status rules against the per-return LangGraph path.
+
+Runs both over the same synthetic book of returns and documents, served from
+memory so only agent-side cost is measured.
+
+Usage: python -m src.status_tracker.benchmark [n_returns ...]
+"""
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Optional
+
+from ..shared.outbox import NotificationOutbox
+from .agent import StatusTrackerAgent
+from .batch import recommend_transitions
+
+# None: uploaded but not yet classified, which both paths must treat alike
+DOC_TYPES = ["w2", "1099-r", "1099-int", "1099-div", "1099-nec", "k1", "other", None]
+RETURN_TYPES = ["1040", "1040", "1040", "1120", "1120s", "1065", "990"]
+STATUSES = ["intake", "documents_pending", "documents_pending", "in_preparation", "filed"]
+
+
+def make_book(n_returns: int, seed: int = 0) -> tuple[list[dict], list[dict]]:
+    """Synthetic returns with 0-4 documents each."""
+    rng = random.Random(seed)
+    returns, documents = [], []
+    for i in range(n_returns):
+        customer_id = f"cust-{i}"
+        returns.append({
+            "id": f"ret-{i}",
+            "customerId": customer_id,
+            "taxYear": 2024,
+            "returnType": rng.choice(RETURN_TYPES),
+            "status": rng.choice(STATUSES),
+        })
+        for j in range(rng.randint(0, 4)):
+            documents.append({
+                "id": f"doc-{i}-{j}",
+                "customerId": customer_id,
+                "taxYear": 2024,
+                "type": rng.choice(DOC_TYPES),
+                "status": rng.choice(["pending", "processed", "verified"]),
+            })
+    return returns, documents
+
+
+class InMemoryAPIClient:
+    """Serves the synthetic book with the APIClient methods the tracker uses."""
+
+    def __init__(self, returns: list[dict], documents: list[dict]):
+        self.returns = {r["id"]: r for r in returns}
+        self.documents: dict = {}
+        for doc in documents:
+            self.documents.setdefault((doc["customerId"], doc["taxYear"]), []).append(doc)
+
+    async def get_return(self, return_id: str) -> dict:
+        return self.returns[return_id]
+
+    async def get(self, endpoint: str, params: Optional[dict] = None) -> dict:
+        key = (params["customerId"], params["taxYear"])
+        return {"data": self.documents.get(key, [])}
+
+    async def update_return_status(self, return_id: str, status: str, notes: str = "") -> dict:
+        return {"id": return_id, "status": status}
+
+
+class NoopCommunicationAgent:
+    async def notify_status_change(self, customer_id: str, new_status: str, return_id: Optional[str] = None) -> bool:
+        return True
+
+
+async def bench_langgraph(returns: list[dict], documents: list[dict]) -> tuple[float, int]:
+    agent = StatusTrackerAgent(
+        api_client=InMemoryAPIClient(returns, documents),
+        communication_agent=NoopCommunicationAgent(),
+        outbox=NotificationOutbox(os.path.join(tempfile.mkdtemp(), "outbox.db")),
+    )
+    start = time.perf_counter()
+    changed = 0
+    for tax_return in returns:
+        result = await agent.check_return(tax_return["id"])
+        changed += bool(result["new_status"])
+    return time.perf_counter() - start, changed
+
+
+def bench_vectorized(returns: list[dict], documents: list[dict]) -> tuple[float, int]:
+    start = time.perf_counter()
+    transitions = recommend_transitions(returns, documents, StatusTrackerAgent.REQUIRED_DOCUMENTS)
+    return time.perf_counter() - start, len(transitions)
+
+
+async def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000]
+
+    for n in sizes:
+        returns, documents = make_book(n)
+        vec_time, vec_changed = bench_vectorized(returns, documents)
+        graph_time, graph_changed = await bench_langgraph(returns, documents)
+
+        print(f"{n:>8,} returns, {len(documents):,} documents")
+        print(f"  langgraph:  {graph_time:8.3f}s  ({n / graph_time:,.0f} returns/s)  {graph_changed:,} transitions")
+        print(f"  vectorized: {vec_time:8.3f}s  ({n / vec_time:,.0f} returns/s)  {vec_changed:,} transitions")
+        print(f"  speedup:    {graph_time / vec_time:8.1f}x")
+        if graph_changed != vec_changed:
+            print("  WARNING: transition counts differ")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,130 @@
+import bisect
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+
+# Statuses that no longer need deadline tracking
+CLOSED_STATUSES = {"completed", "filed", "picked_up"}
+
+SECONDS_PER_DAY = 86400
+
+
+def parse_due_date(due_date_str: str) -> float:
+    """Parse an ISO due date (with optional trailing Z) into a POSIX timestamp."""
+    return datetime.fromisoformat(due_date_str.replace("Z", "+00:00")).timestamp()
+
+
+class DeadlineIndex:
+    """
+    In-memory index of open tax returns ordered by due date.
+
+    Due dates are parsed once, when a return enters the index, and kept in a
+    sorted array so "overdue", "due within N days" and "extension window"
+    queries are binary-searched range lookups instead of full scans.
+
+    The index is kept current from deltas (returns the tracker fetches or
+    updates) and only reloaded in full once it is older than `ttl_seconds`.
+    """
+
+    def __init__(self, ttl_seconds: float = 900.0):
+        self.ttl_seconds = ttl_seconds
+        self.loaded_at: Optional[float] = None
+        # Sorted (due_timestamp, return_id) keys, parallel to _entries
+        self._keys: List[Tuple[float, str]] = []
+        self._entries: dict[str, Tuple[float, dict]] = {}
+        # Status of every return seen, open or closed, for status counts
+        self._statuses: dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def is_stale(self) -> bool:
+        return self.loaded_at is None or time.time() - self.loaded_at > self.ttl_seconds
+
+    def load(self, returns: List[dict]) -> None:
+        """Replace the index contents with a full return listing."""
+        self._keys = []
+        self._entries = {}
+        self._statuses = {}
+        for tax_return in returns:
+            self.upsert(tax_return)
+        self.loaded_at = time.time()
+
+    def upsert(self, tax_return: dict) -> None:
+        """Insert or refresh a single return; closed or undated returns are dropped."""
+        return_id = tax_return.get("id")
+        if not return_id:
+            return
+
+        self.remove(return_id)
+        self._statuses[return_id] = tax_return.get("status", "")
+
+        if tax_return.get("status") in CLOSED_STATUSES:
+            return
+        due_date_str = tax_return.get("dueDate")
+        if not due_date_str:
+            return
+
+        try:
+            due_ts = parse_due_date(due_date_str)
+        except ValueError:
+            print(f"[DeadlineIndex] Skipping return {return_id}: bad dueDate {due_date_str!r}")
+            return
+
+        bisect.insort(self._keys, (due_ts, return_id))
+        self._entries[return_id] = (due_ts, tax_return)
+
+    def update_status(self, return_id: str, status: str) -> None:
+        """Apply a status change without refetching the return."""
+        entry = self._entries.get(return_id)
+        if entry:
+            self.upsert({**entry[1], "status": status})
+        elif return_id in self._statuses:
+            self._statuses[return_id] = status
+
+    def status_counts(self) -> Counter:
+        """Number of returns per status across everything the index has seen."""
+        return Counter(self._statuses.values())
+
+    def remove(self, return_id: str) -> None:
+        entry = self._entries.pop(return_id, None)
+        if entry is None:
+            return
+        i = bisect.bisect_left(self._keys, (entry[0], return_id))
+        if i < len(self._keys) and self._keys[i] == (entry[0], return_id):
+            del self._keys[i]
+
+    def range(self, start: Optional[float] = None, end: Optional[float] = None) -> Iterator[Tuple[float, dict]]:
+        """
+        Yield (due_timestamp, return) for returns due in [start, end), ordered by due date.
+
+        Walks the sorted keys in place. Callers may await between items and
+        the index may change meanwhile, so each step re-finds its position
+        after the last key yielded.
+        """
+        position = 0 if start is None else bisect.bisect_left(self._keys, (start, ""))
+        while position < len(self._keys):
+            key = self._keys[position]
+            due_ts, return_id = key
+            if end is not None and due_ts >= end:
+                return
+            entry = self._entries.get(return_id)
+            # Skip returns removed or moved to another due date meanwhile
+            if entry is not None and entry[0] == due_ts:
+                yield due_ts, entry[1]
+            position = bisect.bisect_right(self._keys, key)
+
+    def overdue(self, now: Optional[float] = None) -> Iterator[Tuple[float, dict]]:
+        return self.range(end=now if now is not None else time.time())
+
+    def due_within(self, days: float, now: Optional[float] = None) -> Iterator[Tuple[float, dict]]:
+        now = now if now is not None else time.time()
+        return self.range(start=now, end=now + days * SECONDS_PER_DAY)
+
+    def due_before(self, days: float, now: Optional[float] = None) -> Iterator[Tuple[float, dict]]:
+        """Everything due before now + days, overdue returns included (extension window)."""
+        now = now if now is not None else time.time()
+        return self.range(end=now + days * SECONDS_PER_DAY)